@@ -2,7 +2,48 @@
 
 import argparse
 import csv
-from astropy.table import Table
+import functools
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+from contextlib import nullcontext
+from operator import itemgetter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'aptx'))
+try:
+    from aptx import LazyModule, profiler, server_request
+except ImportError:
+    # apt_sql.py also runs on its own, without aptx.py. Then numpy is
+    # imported at startup, and there is no profiling and no server.
+    import numpy as np
+
+    class NoProfiler:
+        """Stand-in for aptx.profiler that records nothing.
+        """
+
+        def stage(self, name):
+            return nullcontext()
+
+        def enable(self, filename):
+            print('apt_sql.py: no aptx.py, not profiling', file=sys.stderr)
+
+    profiler = NoProfiler()
+
+    def server_request(op, path, **kwargs):
+        """Return None: there is no server without aptx.py.
+        """
+        return None
+else:
+    # numpy is imported when first used, and astropy.table inside the
+    # methods that build tables, so listing table names and --help start
+    # quickly.
+    np = LazyModule('numpy', globals(), 'np')
 
 def arguments():
     """Parse and return command line arguments.
@@ -12,41 +53,315 @@ def arguments():
                 "\nList available tables, if 'table' is not specified.",
         epilog='example: aptx_sql.py 98765.sql exposures')
     parser.add_argument('sqlfile',help='SQL file exported by APT')
-    parser.add_argument('tablename',nargs='?',default=None,
+    parser.add_argument('tablenames',nargs='*',
             help='Name of a table in the SQL file')
-    return parser.parse_args()
+    parser.add_argument('--export',metavar='OUTFILE',default=None,
+            help='write tables (default: all) to .parquet, .h5 or .fits file')
+    parser.add_argument('--cache',action='store_true',
+            help='cache parsed tables on disk, in $APT_SQL_CACHE'
+            ' or ~/.cache/apt_sql')
+    parser.add_argument('--cache-dir',metavar='DIR',default=None,
+            help='cache parsed tables on disk, in DIR')
+    parser.add_argument('--profile',metavar='FILE',default=None,
+            help='write per-stage timing and memory to JSON FILE,'
+            ' or cProfile dump if FILE ends with .prof')
+    # Allow options between sql file and table names.
+    args = parser.parse_intermixed_args()
+    args.cache = args.cache_dir or args.cache
+    return args
+
+# Quoted literal (with doubled or backslash-escaped quotes) or bare word.
+_VALUE = re.compile(r"'[^'\\]*(?:(?:''|\\.)[^'\\]*)*'|[^\s,']+")
+
+@functools.lru_cache(maxsize=1024)
+def split_keys(keystr):
+    """Return tuple of column names in an sql insert statement.
+    Cached, because every row of a table usually repeats the same list.
+    """
+    return tuple(k.strip() for k in keystr.split(','))
+
+def split_values(valstr):
+    """Return list of values in an sql insert statement, using a regular
+    expression that respects commas and escaped quotes inside literals.
+    Quoted values keep their quotes. NULL is returned as None.
+    """
+    return [None if v == 'NULL' else v for v in _VALUE.findall(valstr)]
+
+def tokenize(statements, prefix):
+    """Tokenize sql insert statements that all begin with prefix.
+    Yield tuple of keys and list of values for each statement.
+
+    Values are split on commas by a single csv reader shared by all
+    statements. A statement is sent to split_values instead, if that
+    yields the wrong number of values (a quoted literal with a comma),
+    or if it has a backslash escape or whitespace before a comma.
+    Quoted values keep their quotes. NULL is returned as None.
+    """
+    start = len(prefix)
+    state = list()
+
+    def valstrs():
+        for line in statements:
+            head, sep, tail = line.partition(') values (')
+            if sep:
+                keystr = head[head.index('(', start) + 1:]
+                valstr = tail.rstrip('); ')
+            else:
+                i = line.index(')', start)
+                keystr = line[line.index('(', start) + 1:i]
+                valstr = line[line.index('(', i) + 1:line.rindex(')')].strip()
+            keys = split_keys(keystr)
+            if ' ,' in valstr or '\\' in valstr:
+                state[:] = [keys, valstr, True]
+                yield ''
+            else:
+                state[:] = [keys, valstr, False]
+                yield valstr
+
+    reader = csv.reader(valstrs(), quoting=csv.QUOTE_NONE,
+            skipinitialspace=True)
+    for vals in reader:
+        keys, valstr, slow = state
+        if slow or (len(vals) != len(keys) and "'" in valstr):
+            vals = split_values(valstr)
+        elif 'NULL' in vals:
+            vals = [None if v == 'NULL' else v for v in vals]
+        yield keys, vals
+
+def tokenize_columns(statements, prefix, chunksize=4096):
+    """Tokenize sql insert statements that all begin with prefix, like
+    tokenize, but a run of statements with the same keys at a time.
+    Yield tuple of keys and list of value lists, one per key.
+
+    The values of a run are joined into one string and split on ', '
+    in a single call, and the columns are cut from the result by
+    slicing. This is valid if the run has exactly one value per key and
+    every comma is followed by one space and nothing else. A quoted
+    literal with a comma adds a value, so it fails the first check.
+    Runs that fail either check go through tokenize, statement by
+    statement. Missing values at the end of a statement are None.
+    """
+    start = len(prefix)
+    statements = iter(statements)
+    for chunk in iter(lambda: list(itertools.islice(statements, chunksize)),
+            []):
+        parts = [line.partition(') values (') for line in chunk]
+        for head, run in itertools.groupby(parts, itemgetter(0)):
+            run = list(run)
+            if run[0][1]:
+                keys = split_keys(head[head.index('(', start) + 1:])
+                n = len(keys)
+                text = ', '.join([p[2].rstrip('); ').lstrip() for p in run])
+                vals = text.split(', ')
+                if len(vals) == n * len(run) \
+                        and text.count(',') == len(vals) - 1 \
+                        and ' ,' not in text and ',  ' not in text:
+                    cols = [vals[i::n] for i in range(n)]
+                    if 'NULL' in text:
+                        for col in cols:
+                            if 'NULL' in col:
+                                col[:] = [None if v == 'NULL' else v
+                                        for v in col]
+                    yield keys, cols
+                    continue
+            for keys, rows in itertools.groupby(tokenize([''.join(p)
+                    for p in run], prefix), itemgetter(0)):
+                n = len(keys)
+                rows = [(vals + [None] * n)[:n] if len(vals) != n else vals
+                        for keys, vals in rows]
+                yield keys, [list(col) for col in zip(*rows)]
+
+class Tablecache:
+    """On-disk cache of tables parsed from one sql file exported by APT.
+
+    The cache directory for an sql file is named after a hash of its path.
+    A manifest records the mtime, size and sha1 hash of the sql file.
+    The cache is discarded if the file changed. Each table is stored as
+    one numpy .npy file per column (and per column mask), which is loaded
+    memory-mapped.
+    """
+
+    def __init__(self, sqlfile, cachedir=None):
+        if cachedir is None or cachedir is True:
+            cachedir = os.getenv('APT_SQL_CACHE') or os.path.join(
+                    os.path.expanduser('~'), '.cache', 'apt_sql')
+        self.sqlfile = os.path.abspath(sqlfile)
+        key = hashlib.sha1(self.sqlfile.encode()).hexdigest()
+        self.dir = os.path.join(cachedir, key)
+        self.manifest = self.validate()
+
+    def filehash(self):
+        """Return sha1 hash of the contents of the sql file.
+        """
+        sha1 = hashlib.sha1()
+        with open(self.sqlfile, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def validate(self):
+        """Return manifest, if cache matches the sql file. Otherwise,
+        clear the cache and return a new manifest.
+        """
+        stat = os.stat(self.sqlfile)
+        try:
+            with open(os.path.join(self.dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = dict()
+        if manifest.get('path') == self.sqlfile \
+                and manifest.get('size') == stat.st_size:
+            if manifest.get('mtime') == stat.st_mtime_ns:
+                return manifest
+            if manifest.get('sha1') == self.filehash():
+                manifest['mtime'] = stat.st_mtime_ns
+                self.write_manifest(manifest)
+                return manifest
+        shutil.rmtree(self.dir, ignore_errors=True)
+        manifest = {'path': self.sqlfile, 'mtime': stat.st_mtime_ns,
+                'size': stat.st_size, 'sha1': self.filehash(),
+                'tablenames': None, 'tables': []}
+        self.write_manifest(manifest)
+        return manifest
+
+    def write_manifest(self, manifest):
+        os.makedirs(self.dir, exist_ok=True)
+        # Unique temporary name, so concurrent runs do not clash.
+        fd, tmpfile = tempfile.mkstemp(prefix='manifest.json.', dir=self.dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmpfile, os.path.join(self.dir, 'manifest.json'))
+
+    @property
+    def tablenames(self):
+        return self.manifest['tablenames']
+
+    @tablenames.setter
+    def tablenames(self, names):
+        self.manifest['tablenames'] = list(names)
+        self.write_manifest(self.manifest)
+
+    def load(self, tablename):
+        """Return memory-mapped table, or None if table is not cached.
+        """
+        from astropy.table import Column, MaskedColumn, Table
+        if tablename not in self.manifest['tables']:
+            return None
+        tabdir = os.path.join(self.dir, 'tables', tablename)
+        with open(os.path.join(tabdir, 'columns.json')) as f:
+            names = json.load(f)
+        cols = list()
+        for i, name in enumerate(names):
+            data = np.load(os.path.join(tabdir, '{}.npy'.format(i)),
+                    mmap_mode='r')
+            maskfile = os.path.join(tabdir, '{}.mask.npy'.format(i))
+            if os.path.exists(maskfile):
+                cols.append(MaskedColumn(data, name=name, copy=False,
+                        mask=np.load(maskfile, mmap_mode='r')))
+            else:
+                cols.append(Column(data, name=name, copy=False))
+        return Table(cols, copy=False)
+
+    def save(self, tablename, table):
+        """Write table to cache, one .npy file per column.
+        """
+        from astropy.table import MaskedColumn
+        tabdir = os.path.join(self.dir, 'tables', tablename)
+        os.makedirs(os.path.dirname(tabdir), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(prefix=tablename + '.',
+                dir=os.path.dirname(tabdir))
+        for i, col in enumerate(table.itercols()):
+            np.save(os.path.join(tmpdir, '{}.npy'.format(i)),
+                    np.asarray(col.data))
+            if isinstance(col, MaskedColumn):
+                np.save(os.path.join(tmpdir, '{}.mask.npy'.format(i)),
+                        np.ma.getmaskarray(col))
+        with open(os.path.join(tmpdir, 'columns.json'), 'w') as f:
+            json.dump(table.colnames, f)
+        shutil.rmtree(tabdir, ignore_errors=True)
+        try:
+            os.replace(tmpdir, tabdir)
+        except OSError:
+            # Another run saved the same table first.
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        if tablename not in self.manifest['tables']:
+            self.manifest['tables'].append(tablename)
+            self.write_manifest(self.manifest)
 
 class Sqlfile:
     """An sql file exported by APT.
     """
 
-    def __init__(self, sqlfile):
-        """Read data from sql file. Get list of tables names.
+    def __init__(self, sqlfile, stream=False, cache=None):
+        """Read data from sql file. Index insert statements by table name.
+        If stream is True, do not hold the file in memory. Instead, read
+        it lazily each time rows are requested (see iter_rows).
+        If cache is True or a directory name, keep parsed tables in an
+        on-disk Tablecache. Do not read the sql file, if the cache has the
+        table names, until a table is requested that is not yet cached.
         """
         self.__sqlfile = sqlfile
-        self.__sql = self.sqlread()
-        self.tablenames = self.tablenames()
+        self.__stream = stream
+        self.__tablenames = None
+        self.__sql, self.__index = None, None
+        self.__cache = Tablecache(sqlfile, cache) if cache else None
+        if self.__cache is not None:
+            self.__tablenames = self.__cache.tablenames
+        if not stream and self.__tablenames is None:
+            self.__sql, self.__index = self.sqlread()
 
     def sqlread(self):
         """Read sql file exported by APT. Strip trailing newlines.
+        In the same pass, record the line number of each insert statement
+        in a per-table index, so later table lookups need not rescan.
         """
+        prefix = 'insert into '
         sql = list()
-        with open(self.__sqlfile, 'r') as f:
+        index = dict()
+        with profiler.stage('sql read'), open(self.__sqlfile, 'r') as f:
             for line in f:
-                sql.append(line.rstrip())
-        return sql
+                line = line.rstrip()
+                if line[:len(prefix)] == prefix:
+                    name = line[len(prefix):line.find('(')].strip()
+                    index.setdefault(name, []).append(len(sql))
+                sql.append(line)
+        return sql, index
 
+    @property
     def tablenames(self):
-        """Parse sql insert statements to determine table names.
+        """Sorted list of table names in the sql file.
+        In stream mode, scan the file once, keeping only the names.
         """
-        prefix = 'insert into '
-        names = list()
-        for line in self.__sql:
-            if line[:len(prefix)] == prefix:
-                names.append(line[len(prefix):line.find('(')].strip())
-        names = sorted(list(set(names)))
-        names.remove('#AOK values')
-        return names
+        if self.__tablenames is None:
+            if self.__index is not None:
+                names = self.__index.keys()
+            else:
+                prefix = 'insert into '
+                names = set()
+                with open(self.__sqlfile, 'r') as f:
+                    for line in f:
+                        if line[:len(prefix)] == prefix:
+                            names.add(line[len(prefix):line.find('(')].strip())
+            self.__tablenames = sorted(n for n in names if n != '#AOK values')
+            if self.__cache is not None:
+                self.__cache.tablenames = self.__tablenames
+        return self.__tablenames
+
+    def lines(self, tablename):
+        """Yield the sql insert statements for the specified table.
+        Use the index if the file is in memory. Otherwise read the file.
+        """
+        if self.__index is None and not self.__stream:
+            self.__sql, self.__index = self.sqlread()
+        if self.__index is not None:
+            for i in self.__index.get(tablename, []):
+                yield self.__sql[i]
+        else:
+            prefix = 'insert into ' + tablename + ' '
+            with open(self.__sqlfile, 'r') as f:
+                for line in f:
+                    if line[:len(prefix)] == prefix:
+                        yield line.rstrip()
 
     def rows_from_sql(self, tablename):
         """Return dictionary for each row in the specified table.
@@ -54,16 +369,53 @@ class Sqlfile:
         """
         prefix = 'insert into ' + tablename + ' '
         rows = list()
-        for line in self.__sql:
-            if line[:len(prefix)] == prefix:
-                keyval_str = line[len(prefix):].strip()
-                keystr, valstr = keyval_str.split('values')
-                keys = [k.strip() for k in keystr[2:-2].split(',')]
-                vals = [v.strip() for v in valstr[2:-2].split(',')]
-                keyval_dict = dict(zip(keys, vals))
-                rows.append(keyval_dict)
+        for keys, vals in tokenize(self.lines(tablename), prefix):
+            rows.append(dict(zip(keys, vals)))
         return rows
 
+    def cols_from_sql(self, tablename):
+        """Return dictionary of column buffers for the specified table.
+        Values are appended straight to per-column lists, without building
+        a dictionary per row, a run of rows with the same keys at a time
+        (see tokenize_columns). Rows that lack a key get None in that
+        column.
+        """
+        prefix = 'insert into ' + tablename + ' '
+        cols = dict()
+        nrows = 0
+        for keys, vals in tokenize_columns(self.lines(tablename), prefix):
+            for key, col in zip(keys, vals):
+                buf = cols.get(key)
+                if buf is None:
+                    buf = cols[key] = [None] * nrows
+                elif len(buf) < nrows:
+                    buf.extend([None] * (nrows - len(buf)))
+                buf.extend(col)
+            if vals:
+                nrows += len(vals[0])
+        for col in cols.values():
+            col.extend([None] * (nrows - len(col)))
+        return cols
+
+    def iter_rows(self, tablename, chunksize=10000, astable=False):
+        """Yield rows of the specified table in chunks of chunksize rows.
+        Each chunk is a list of dictionaries, as from rows_from_sql,
+        or an astropy table if astable is True. Column types are inferred
+        separately for each chunk. In stream mode, only one chunk is held
+        in memory at a time.
+        """
+        prefix = 'insert into ' + tablename + ' '
+        rows = list()
+        for keys, vals in tokenize(self.lines(tablename), prefix):
+            rows.append(dict(zip(keys, vals)))
+            if len(rows) == chunksize:
+                yield self.cols_from_rows(rows, self.keys(rows)) \
+                        if astable else rows
+                rows = list()
+        if rows:
+            yield self.cols_from_rows(rows, self.keys(rows)) \
+                    if astable else rows
+
     def keys(self, rows):
         keys = set()
         for row in rows:
@@ -71,21 +423,55 @@ class Sqlfile:
         keys = sorted(list(keys))
         return keys
 
+    def column(self, key, vals):
+        """Convert list of value strings to an astropy column.
+        Try integer, then float, for the whole column at once, converting
+        with map and numpy.fromiter. Integers too large for int64 stay
+        strings. Otherwise strip beginning and ending single quote from
+        strings, with numpy string functions, and unescape quotes inside
+        them. Missing values (None) are masked.
+        """
+        from astropy.table import Column, MaskedColumn
+        if None in vals:
+            filled = np.array(vals, dtype=object)
+            mask = np.equal(filled, None)
+            filled[mask] = '0'
+            filled = filled.tolist()
+        else:
+            filled = vals
+            mask = np.zeros(len(vals), dtype=bool)
+        data = None
+        for func, dtype in ((int, np.int64), (float, np.float64)):
+            try:
+                data = np.fromiter(map(func, filled), dtype, len(filled))
+                break
+            except ValueError:
+                pass
+            except OverflowError:
+                # Integers too large for int64 would lose digits as
+                # float64, so keep them as strings.
+                break
+        if data is None:
+            raw = np.array(filled, dtype=str)
+            raw[mask] = ''
+            data = raw.copy()
+            quoted = np.char.startswith(raw, "'") & np.char.endswith(raw, "'")
+            inner = np.char.strip(raw[quoted], "'")
+            odd = np.char.str_len(inner) != np.char.str_len(raw[quoted]) - 2
+            odd |= np.char.find(inner, "'") >= 0
+            odd |= np.char.find(inner, '\\') >= 0
+            inner[odd] = [x[1:-1].replace("''", "'").replace("\\'", "'")
+                    for x in raw[quoted][odd]]
+            data[quoted] = inner
+        if mask.any():
+            return MaskedColumn(data, name=key, mask=mask)
+        return Column(data, name=key)
+
     def cols_from_rows(self, rows, keys):
+        from astropy.table import Table
         table = Table()
         for key in keys:
-            col = list()
-            for row in rows:
-                col.append(row.get(key, ''))
-            try:
-                col = [int(x) for x in col]
-            except ValueError:
-                try:
-                    col = [float(x) for x in col]
-                except ValueError:
-                    col = [x[1:-1] if x.startswith("'") and x.endswith("'") \
-                            else x for x in col]
-            table[key] = col
+            table[key] = self.column(key, [row.get(key) for row in rows])
         return table
 
     def table(self, tablename, browser=False):
@@ -93,17 +479,70 @@ class Sqlfile:
         For the 'exposures' table, discard rows with apt_label == 'BASE'.
         Convert column data type to integer or float, where possible.
         Strip beginning and ending single quote from strings.
+        Mask values for keys missing from some insert statements.
+        If the table is in the on-disk cache, load it instead.
         """
-        rows = self.rows_from_sql(tablename)
-        keys = self.keys(rows)
-        if len(keys) == 0:
-            raise Exception("no '" + tablename + "' table in " + self.__sqlfile)
-        table = self.cols_from_rows(rows, keys)
+        from astropy.table import Table
+        table = None
+        if self.__cache is not None:
+            with profiler.stage('cache load'):
+                table = self.__cache.load(tablename)
+        if table is None:
+            with profiler.stage('sql tokenize'):
+                cols = self.cols_from_sql(tablename)
+            if len(cols) == 0:
+                raise Exception("no '" + tablename + "' table in "
+                        + self.__sqlfile)
+            with profiler.stage('table build'):
+                table = Table([self.column(key, cols[key])
+                        for key in sorted(cols)])
+            if self.__cache is not None:
+                with profiler.stage('cache save'):
+                    self.__cache.save(tablename, table)
         if browser:
             self.browser(table)
         return table
 
-    def browser(self, table):
+    def export(self, filename, tablenames=None):
+        """Write tables (default: all) to a file. The format is set by the
+        extension: .fits (one extension per table), .h5 or .hdf5 (one path
+        per table, needs h5py), or .parquet (needs pyarrow). Parquet holds
+        one table per file, so several tables are written to files named
+        root.tablename.parquet. Return list of files written.
+        """
+        if not tablenames:
+            tablenames = self.tablenames
+        root, ext = os.path.splitext(filename)
+        ext = ext.lower()
+        if ext == '.fits':
+            from astropy.io import fits
+            hdus = [fits.PrimaryHDU()]
+            for name in tablenames:
+                hdu = fits.table_to_hdu(self.table(name))
+                hdu.name = name
+                hdus.append(hdu)
+            fits.HDUList(hdus).writeto(filename, overwrite=True)
+            return [filename]
+        if ext in ('.h5', '.hdf5'):
+            if os.path.exists(filename):
+                os.remove(filename)
+            for name in tablenames:
+                self.table(name).write(filename, path=name, append=True,
+                        serialize_meta=True)
+            return [filename]
+        if ext == '.parquet':
+            if len(tablenames) == 1:
+                outfiles = [filename]
+            else:
+                outfiles = [root + '.' + name + ext for name in tablenames]
+            for name, outfile in zip(tablenames, outfiles):
+                self.table(name).write(outfile, format='parquet',
+                        overwrite=True)
+            return outfiles
+        raise ValueError('unknown export format: ' + filename)
+
+    @staticmethod
+    def browser(table):
         """Diplay copy of astropy table in a browser window.
         Convert underscores to spaces in column headers to allow wrapping.
         """
@@ -114,11 +553,43 @@ class Sqlfile:
                 out.rename_column(key, newkey)
         out.show_in_browser(jsviewer=True, show_row_index=False)
 
+def serve(args):
+    """Show tables, or list table names, with a running aptx_server.py,
+    which keeps parsed sql files in memory. Return False if no server is
+    listening.
+    """
+    for tablename in args.tablenames or [None]:
+        if tablename is None:
+            res = server_request('tablenames', args.sqlfile)
+        else:
+            res = server_request('table', args.sqlfile, tablename=tablename)
+        if res is None:
+            return False
+        if res.error:
+            raise Exception(res.error)
+        if tablename is None:
+            print('specify a table name as the second argument:')
+            for name in res.result:
+                print(name)
+        else:
+            Sqlfile.browser(res.result)
+    return True
+
 def main():
     args = arguments()
-    sql = Sqlfile(args.sqlfile)
-    if args.tablename:
-        table = sql.table(args.tablename, browser=True)
+    if args.profile:
+        profiler.enable(args.profile)
+    if not (args.export or args.cache) and serve(args):
+        return
+    sql = Sqlfile(args.sqlfile, cache=args.cache)
+    if args.export:
+        with profiler.stage('export'):
+            outfiles = sql.export(args.export, args.tablenames)
+        for outfile in outfiles:
+            print('wrote ' + outfile)
+    elif args.tablenames:
+        for tablename in args.tablenames:
+            table = sql.table(tablename, browser=True)
     else:
         print('specify a table name as the second argument:')
         for name in sql.tablenames:
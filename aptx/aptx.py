@@ -1,10 +1,320 @@
+import atexit
+import copy
+import cProfile
+import functools
+import hashlib
+import importlib
+import json
+import multiprocessing
 import os
+import pickle
+import resource
+import shutil
+import signal
+import struct
 import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
 import zipfile
-from astropy import units as u
-from astropy.coordinates import SkyCoord
-from astropy.table import Table
-from lxml import etree
+from collections import namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from io import BytesIO, StringIO
+
+class LazyModule:
+    """Stand-in for a module, imported on first attribute access. It then
+    replaces itself with the module in the namespace it was bound in, so
+    later lookups cost nothing extra. Keeps heavy imports (numpy, lxml)
+    off the startup path of scripts that do not need them.
+    """
+
+    def __init__(self, name, namespace, alias):
+        self._name = name
+        self._namespace = namespace
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        self._namespace[self._alias] = module
+        return getattr(module, attr)
+
+# numpy and lxml are imported when first used. astropy, which is slower to
+# import, is imported inside the functions that need it.
+np = LazyModule('numpy', globals(), 'np')
+etree = LazyModule('lxml.etree', globals(), 'etree')
+
+class Profiler:
+    """Opt-in record of wall time, CPU time and peak memory per stage.
+
+    Code marks stages with `with profiler.stage(name):`. This costs one
+    attribute check when profiling is off. Enable with the APTX_PROFILE
+    environment variable or the --profile option of the scripts, set to a
+    file name. A name ending in .prof gets a cProfile dump, for pstats or
+    snakeviz. Any other name gets a JSON report of the stages, with peak
+    memory traced by tracemalloc. Stages run in batch worker processes
+    (--jobs > 1) are not included.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.stages = {}
+        self._peaks = []
+        self._cprofile = None
+
+    def enable(self, filename):
+        """Start profiling, and write report to filename at exit.
+        """
+        if self.filename is not None:
+            return
+        self.filename = filename
+        self.start = (time.perf_counter(), time.process_time())
+        if filename.endswith('.prof'):
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self.enabled = True
+            tracemalloc.start()
+        atexit.register(self.dump)
+
+    @contextmanager
+    def _stage(self, name):
+        # Keep the peak memory of enclosing stages, since tracemalloc has
+        # a single peak, reset at the start and end of each stage.
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        tracemalloc.reset_peak()
+        self._peaks.append(0)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            stats = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0,
+                    'cpu': 0.0, 'peakmem': 0})
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['peakmem'] = max(stats['peakmem'], peak)
+
+    def stage(self, name):
+        """Return context manager that records a stage, if enabled.
+        """
+        return self._stage(name) if self.enabled else _nostage
+
+    def report(self):
+        """Return dictionary of totals and per-stage statistics.
+        """
+        return {'argv': sys.argv, 'python': sys.version.split()[0],
+                'wall': time.perf_counter() - self.start[0],
+                'cpu': time.process_time() - self.start[1],
+                'maxrss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+                'stages': self.stages}
+
+    def dump(self):
+        """Write cProfile dump or JSON report to the file.
+        """
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.filename)
+        else:
+            with open(self.filename, 'w') as f:
+                json.dump(self.report(), f, indent=1)
+        print('wrote profile to {}'.format(self.filename), file=sys.stderr)
+
+# Context manager that does nothing, returned when profiling is off.
+_nostage = nullcontext()
+
+# Profiler shared by aptx, the aptx_* scripts and apt_sql.py. Worker
+# processes inherit the environment, but must not overwrite the report.
+profiler = Profiler()
+if os.getenv('APTX_PROFILE') and multiprocessing.parent_process() is None:
+    profiler.enable(os.getenv('APTX_PROFILE'))
+
+# Canonical namespace map for APT proposal XML. Shared, never modified.
+NS = {'apt': 'http://www.stsci.edu/JWST/APT'}
+
+# Registry of compiled XPath expressions, keyed by expression.
+_xpaths = {}
+
+def xpath(path):
+    """Return compiled XPath for path, using the canonical namespace map.
+    Each expression is compiled once and kept in a module-level registry.
+    """
+    try:
+        return _xpaths[path]
+    except KeyError:
+        _xpaths[path] = etree.XPath(path, namespaces=NS)
+        return _xpaths[path]
+
+def descendant(elem, tag):
+    """Return first descendant of elem with the specified APT tag, or None.
+    """
+    with profiler.stage('xpath'):
+        result = xpath('descendant::apt:' + tag + '[1]')(elem)
+    return result[0] if result else None
+
+def text(elem, type=str):
+    """Return text of elem converted to type, or None if elem is missing
+    or empty.
+    """
+    if elem is None or not elem.text:
+        return None
+    return type(elem.text)
+
+# Detached snapshots of targets, observations and mosaics. They hold only
+# strings and numbers, so the XML tree can be freed once they are made.
+TargetRecord = namedtuple('TargetRecord', ('aptxfile', 'number',
+        'propname', 'archname', 'coord', 'pmra', 'pmrau', 'pmdec', 'pmdecu'))
+MosaicRecord = namedtuple('MosaicRecord', ('rows', 'columns',
+        'rowoverlap', 'coloverlap', 'xskew', 'yskew'))
+ObservationRecord = namedtuple('ObservationRecord', ('aptxfile', 'number',
+        'targetid', 'instrument', 'templateid', 'templatename', 'mosaic'))
+# Types of record table columns that are not strings. They are fixed, so
+# a column has the same dtype whatever its values, even all None.
+_RECORD_TYPES = {'pmra': float, 'pmdec': float, 'mosaic_rows': int,
+        'mosaic_columns': int, 'mosaic_rowoverlap': float,
+        'mosaic_coloverlap': float, 'mosaic_xskew': float,
+        'mosaic_yskew': float}
+
+def records_table(records):
+    """Return astropy table with one row per record. All records must be
+    the same type. Fields of nested MosaicRecord become 'mosaic_' columns.
+    Proper motions, mosaic overlaps and skews are float columns, mosaic
+    rows and columns int, other fields strings. None is masked.
+    """
+    from astropy.table import MaskedColumn, Table
+    cols = {}
+    for record in records:
+        for name, value in zip(record._fields, record):
+            if name == 'mosaic':
+                value = value or MosaicRecord(*[None]*len(MosaicRecord._fields))
+                for subname, subvalue in zip(value._fields, value):
+                    cols.setdefault('mosaic_'+subname, []).append(subvalue)
+            else:
+                cols.setdefault(name, []).append(value)
+    table = Table(masked=True)
+    for name, values in cols.items():
+        mask = [v is None for v in values]
+        dtype = _RECORD_TYPES.get(name, str)
+        fill = dtype()
+        table[name] = MaskedColumn([fill if m else v
+                for v, m in zip(values, mask)], mask=mask, dtype=dtype)
+    return table
+
+# Factors to convert proper motion units used in APT to mas/yr.
+# RA in seconds of time per year is converted at 15 arcsec per second.
+_PMUNITS = {'mas/yr': 1.0, 'milliarcsec/yr': 1.0, 'arcsec/yr': 1e3,
+        'sec/yr': 1e3, 's/yr': 1e3, 'deg/yr': 3.6e6, 'degrees/yr': 3.6e6}
+# For RA, seconds are seconds of time.
+_PMRATIME = {'sec/yr': 15e3, 's/yr': 15e3}
+
+def pmkey(units):
+    """Return normalized proper motion units string.
+    """
+    return (units or 'mas/yr').strip().lower().replace('year', 'yr')
+
+def pmfactor(units, ra=False):
+    """Return factor that converts proper motion units to mas/yr.
+    Seconds are seconds of arc, or seconds of time if ra is True. Then
+    the factor gives the rate of change of RA in mas/yr, which must still
+    be multiplied by cos(dec) to give a rate on the sky like the other
+    units (see target_table). Return NaN for units that cannot be
+    converted.
+    """
+    key = pmkey(units)
+    if ra and key in _PMRATIME:
+        return _PMRATIME[key]
+    if key in _PMUNITS:
+        return _PMUNITS[key]
+    from astropy import units as u
+    try:
+        return u.Unit(units).to(u.mas/u.yr)
+    except (ValueError, TypeError, u.UnitsError):
+        return np.nan
+
+def parse_coords(coords):
+    """Convert sexagesimal 'hh mm ss.s +dd mm ss.s' strings to arrays of
+    RA and Dec in degrees, without constructing a SkyCoord per string.
+    Strings that do not have six fields give NaN.
+    """
+    coords = list(coords)
+    ra = np.full(len(coords), np.nan)
+    dec = np.full(len(coords), np.nan)
+    words = [c.split() if c else [] for c in coords]
+    good = np.array([len(w) == 6 for w in words], dtype=bool)
+    if good.any():
+        tokens = [t for w, g in zip(words, good) if g for t in w]
+        hms = np.fromiter(map(float, tokens), np.float64,
+                len(tokens)).reshape(-1, 6)
+        sign = np.where(np.char.startswith(np.array(tokens[3::6]), '-'),
+                -1.0, 1.0)
+        ra[good] = 15.0 * (hms[:, 0] + hms[:, 1]/60.0 + hms[:, 2]/3600.0)
+        dec[good] = sign * (np.abs(hms[:, 3]) + hms[:, 4]/60.0
+                + hms[:, 5]/3600.0)
+    return ra, dec
+
+def target_table(proposals):
+    """Return astropy table of targets in many proposals, with RA and Dec
+    in degrees, proper motions in mas/yr, and one vectorized SkyCoord.
+    pmra is the rate on the sky, i.e. includes the cos(dec) factor.
+
+    Parameters
+    ----------
+    proposals : iterable of Proposal objects, .aptx file names, or
+        TargetRecord objects
+    """
+    from astropy import units as u
+    from astropy.coordinates import SkyCoord
+    from astropy.table import Table
+    records = []
+    for prop in proposals:
+        if isinstance(prop, TargetRecord):
+            records.append(prop)
+        else:
+            if not isinstance(prop, Proposal):
+                prop = Proposal(prop)
+            records.extend(prop.target_records())
+    ra, dec = parse_coords([r.coord for r in records])
+    pm = {}
+    for name in ('pmra', 'pmdec'):
+        values = np.array([getattr(r, name) for r in records], dtype=float)
+        units = np.array([getattr(r, name+'u') or '' for r in records],
+                dtype=object)
+        factor = np.ones(len(records))
+        for unit in set(units):
+            rows = units == unit
+            factor[rows] = pmfactor(unit, ra=name == 'pmra')
+            if name == 'pmra' and pmkey(unit) in _PMRATIME:
+                factor[rows] *= np.cos(np.radians(dec[rows]))
+        pm[name] = values * factor
+    table = Table()
+    table['aptxfile'] = [r.aptxfile or '' for r in records]
+    table['number'] = [r.number or '' for r in records]
+    table['propname'] = [r.propname or '' for r in records]
+    table['archname'] = [r.archname or '' for r in records]
+    table['ra'] = ra * u.deg
+    table['dec'] = dec * u.deg
+    table['pmra'] = pm['pmra'] * u.mas/u.yr
+    table['pmdec'] = pm['pmdec'] * u.mas/u.yr
+    with profiler.stage('skycoord'):
+        table['skycoord'] = SkyCoord(ra*u.deg, dec*u.deg)
+    return table
+
+def records_array(records):
+    """Return numpy structured (masked) array with one row per record.
+    """
+    return records_table(records).as_array()
 
 # Define class to handle target specification in an aptx file
 class Target:
@@ -17,16 +327,15 @@ class Target:
 
     def __init__(self, elem):
         self.elem = elem
-        self.ns = elem.nsmap
-        self.ns['apt'] = self.ns.pop(None)
-        self.number = elem.find('.//apt:Number', self.ns)
-        self.propname = elem.find('.//apt:TargetName', self.ns)
-        self.archname = elem.find('.//apt:TargetID', self.ns)
-        self.coord = elem.find('.//apt:EquatorialCoordinates', self.ns)
-        self.pmra = elem.find('.//apt:RAProperMotion', self.ns)
-        self.pmrau = elem.find('.//apt:RAProperMotionUnits', self.ns)
-        self.pmdec = elem.find('.//apt:DecProperMotion', self.ns)
-        self.pmdecu = elem.find('.//apt:DecProperMotionUnits', self.ns)
+        self.ns = NS
+        self.number = descendant(elem, 'Number')
+        self.propname = descendant(elem, 'TargetName')
+        self.archname = descendant(elem, 'TargetID')
+        self.coord = descendant(elem, 'EquatorialCoordinates')
+        self.pmra = descendant(elem, 'RAProperMotion')
+        self.pmrau = descendant(elem, 'RAProperMotionUnits')
+        self.pmdec = descendant(elem, 'DecProperMotion')
+        self.pmdecu = descendant(elem, 'DecProperMotionUnits')
 
     def xmldump(self):
         """Print to screen contents of XML <Target> element.
@@ -36,6 +345,8 @@ class Target:
                 print(line)
 
     def summary(self):
+        from astropy import units as u
+        from astropy.coordinates import SkyCoord
         _eqstr = self.coord.attrib['Value']
         _rastr = ' '.join(_eqstr.split(' ')[0:3])
         _destr = ' '.join(_eqstr.split(' ')[3:6])
@@ -51,6 +362,15 @@ class Target:
                 'pmRA',self.pmra.text,self.pmrau.text or '',
                 'pmDec',self.pmdec.text,self.pmdecu.text or ''))
 
+    def record(self, aptxfile=None):
+        """Return detached TargetRecord snapshot of this target.
+        """
+        return TargetRecord(aptxfile, text(self.number),
+                text(self.propname), text(self.archname),
+                self.coord.get('Value') if self.coord is not None else None,
+                text(self.pmra, float), text(self.pmrau),
+                text(self.pmdec, float), text(self.pmdecu))
+
     def update(self,number=None,propname=None,archname=None,
             coord=None,pmra=None,pmdec=None,pmrau=None,pmdecu=None):
         if number is not None:
@@ -73,8 +393,7 @@ class Target:
 class Template:
     def __init__(self, elem):
         self.elem = elem
-        self.ns = elem.nsmap
-        self.ns['apt'] = self.ns.pop(None)
+        self.ns = NS
         _elem1 = self.elem.getchildren()[0]
         self.templateid = _elem1.prefix
         try:
@@ -96,14 +415,13 @@ class Template:
 class MosaicParameters:
     def __init__(self, elem):
         self.elem = elem
-        self.ns = elem.nsmap
-        self.ns['apt'] = self.ns.pop(None)
-        self.rows = elem.find('.//apt:Rows', self.ns)
-        self.columns = elem.find('.//apt:Columns', self.ns)
-        self.rowoverlap = elem.find('.//apt:RowOverlapPercent', self.ns)
-        self.coloverlap = elem.find('.//apt:ColumnOverlapPercent', self.ns)
-        self.xskew = elem.find('.//apt:SkewDegreesX', self.ns)
-        self.yskew = elem.find('.//apt:SkewDegreesY', self.ns)
+        self.ns = NS
+        self.rows = descendant(elem, 'Rows')
+        self.columns = descendant(elem, 'Columns')
+        self.rowoverlap = descendant(elem, 'RowOverlapPercent')
+        self.coloverlap = descendant(elem, 'ColumnOverlapPercent')
+        self.xskew = descendant(elem, 'SkewDegreesX')
+        self.yskew = descendant(elem, 'SkewDegreesY')
 
     def summary(self):
         print("{}={}, {}={}%, {}={} degrees".format(
@@ -115,6 +433,13 @@ class MosaicParameters:
                 'Overlap', self.coloverlap.text,
                 'Yskew', self.yskew.text))
 
+    def record(self):
+        """Return detached MosaicRecord snapshot of these parameters.
+        """
+        return MosaicRecord(text(self.rows, int), text(self.columns, int),
+                text(self.rowoverlap, float), text(self.coloverlap, float),
+                text(self.xskew, float), text(self.yskew, float))
+
     def xmldump(self):
         key = 'MosaicParameters'
         for line in etree.tostring(self.elem).splitlines():
@@ -125,11 +450,10 @@ class MosaicParameters:
 class Observation:
     def __init__(self, elem):
         self.elem = elem
-        self.ns = elem.nsmap
-        self.ns['apt'] = self.ns.pop(None)
-        self.number = elem.find('.//apt:Number', self.ns)
-        self.targetid = elem.find('.//apt:TargetID', self.ns)
-        self.instrument = elem.find('.//apt:Instrument', self.ns)
+        self.ns = NS
+        self.number = descendant(elem, 'Number')
+        self.targetid = descendant(elem, 'TargetID')
+        self.instrument = descendant(elem, 'Instrument')
 
     def xmldump(self):
         for line in etree.tostring(self.elem).splitlines():
@@ -138,13 +462,11 @@ class Observation:
                 print(line)
 
     def template(self, name=None):
-        _xpath = './/apt:Template'
-        _elem = self.elem.xpath(_xpath, namespaces=self.ns)[0]
+        _elem = xpath('descendant::apt:Template[1]')(self.elem)[0]
         return Template(_elem)
 
     def mosaic(self):
-        _xpath = './/apt:MosaicParameters'
-        _elem = self.elem.xpath(_xpath, namespaces=self.ns)[0]
+        _elem = xpath('descendant::apt:MosaicParameters[1]')(self.elem)[0]
         return MosaicParameters(_elem)
 
     def summary(self):
@@ -156,6 +478,19 @@ class Observation:
         temp = self.template()
         temp.summary()
 
+    def record(self, aptxfile=None):
+        """Return detached ObservationRecord snapshot of this observation,
+        including template ID and name, and mosaic parameters (or None).
+        """
+        _temp = xpath('descendant::apt:Template[1]')(self.elem)
+        _temp = Template(_temp[0]) if _temp else None
+        _mosaic = xpath('descendant::apt:MosaicParameters[1]')(self.elem)
+        return ObservationRecord(aptxfile, text(self.number),
+                text(self.targetid), text(self.instrument),
+                _temp.templateid if _temp else None,
+                _temp.templatename if _temp else None,
+                MosaicParameters(_mosaic[0]).record() if _mosaic else None)
+
     def update(self,number=None,targetid=None,instrument=None,
             mosaic=None):
         if number is not None:
@@ -165,109 +500,834 @@ class Observation:
         if instrument is not None:
             self.instrument.text=instrument
         if mosaic is not None:
-            _xpath = './/apt:MosaicParameters'
-            _old = self.elem.xpath(_xpath, namespaces=self.ns)[0]
+            _old = xpath('descendant::apt:MosaicParameters[1]')(self.elem)[0]
             _old.getparent().replace(_old, mosaic.elem)
 
+class ZipMembers(MutableMapping):
+    """Dictionary of member name and contents of a zip file, which reads
+    each member from the zip file only when it is first requested.
+    """
+
+    def __init__(self, zipname):
+        self.zipname = zipname
+        with zipfile.ZipFile(zipname) as zfile:
+            self.names = zfile.namelist()
+        self.data = {}
+
+    def __getitem__(self, name):
+        if name not in self.data:
+            if name not in self.names:
+                raise KeyError(name)
+            with profiler.stage('zip read'), \
+                    zipfile.ZipFile(self.zipname) as zfile:
+                self.data[name] = zfile.read(name)
+        return self.data[name]
+
+    def __setitem__(self, name, value):
+        if name not in self.names:
+            self.names.append(name)
+        self.data[name] = value
+
+    def __delitem__(self, name):
+        self.names.remove(name)
+        self.data.pop(name, None)
+
+    def __iter__(self):
+        return iter(list(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def open(self, name):
+        """Return file object that streams an unread member from the zip.
+        """
+        if name in self.data:
+            return BytesIO(self.data[name])
+        with zipfile.ZipFile(self.zipname) as zfile:
+            return zfile.open(name)
+
+def xmlname(aptxfile, names):
+    """Return name of the proposal XML member in an .aptx zip file.
+    """
+    xmlfile = os.path.splitext(os.path.basename(aptxfile))[0]+'.xml'
+    if xmlfile not in names:
+        xmlfiles = [n for n in names
+                if n.endswith('.xml') and not n.startswith('META-INF')]
+        if xmlfiles:
+            xmlfile = xmlfiles[0]
+    return xmlfile
+
 class Proposal:
-    def __init__(self, aptxfile):
-        with zipfile.ZipFile(aptxfile) as zfile:
-            self.zdata = {name: zfile.read(name) for name in zfile.namelist()}
+    """Represent an APT proposal in an .aptx file.
+
+    Parameters
+    ----------
+    aptxfile : name of .aptx file
+    lazy : if True, read zip members and parse XML only when needed.
+        Header-level facts (schemaversion, targnums, obsnums) are then
+        obtained with a streaming parse that stops as soon as possible.
+    """
+
+    def __init__(self, aptxfile, lazy=False):
         self.aptxfile = aptxfile
-        self.xmlfile = os.path.splitext(aptxfile)[0]+'.xml'
-        self.doctype = self.zdata[self.xmlfile].splitlines()[0]
-        self.root = etree.fromstring(self.zdata[self.xmlfile])
-        self.ns = self.root.nsmap
-        self.ns['apt'] = self.ns.pop(None)
-        self.schemaversion = self.root.get('schemaVersion')
+        self._root = None
+        self._ns = None
+        self._index = {}
+        if lazy:
+            self.zdata = ZipMembers(aptxfile)
+        else:
+            with profiler.stage('zip read'), \
+                    zipfile.ZipFile(aptxfile) as zfile:
+                self.zdata = {name: zfile.read(name)
+                        for name in zfile.namelist()}
+        self.xmlfile = xmlname(aptxfile, list(self.zdata))
+        if not lazy:
+            self.root
+
+    @property
+    def root(self):
+        if self._root is None:
+            xml = self.zdata[self.xmlfile]
+            with profiler.stage('xml parse'):
+                self._root = etree.fromstring(xml)
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        self._root = root
+        self._ns = None
+        self._index = {}
+
+    @property
+    def ns(self):
+        if self._ns is None:
+            self._ns = self.root.nsmap
+            self._ns['apt'] = self._ns.pop(None)
+        return self._ns
+
+    @property
+    def doctype(self):
+        if self._root is None and isinstance(self.zdata, ZipMembers):
+            with self.zdata.open(self.xmlfile) as stream:
+                return stream.readline().rstrip(b'\r\n')
+        return self.zdata[self.xmlfile].splitlines()[0]
+
+    @property
+    def schemaversion(self):
+        if self._root is None:
+            for event, elem in self.iterparse(events=('start',)):
+                return elem.get('schemaVersion')
+        return self.root.get('schemaVersion')
+
+    def iterparse(self, **kwargs):
+        """Yield (event, element) from a streaming parse of the proposal
+        XML. Stopping early avoids reading the rest of the zip member.
+        """
+        with self.zdata.open(self.xmlfile) if isinstance(self.zdata,
+                ZipMembers) else BytesIO(self.zdata[self.xmlfile]) as stream:
+            for event, elem in etree.iterparse(stream, **kwargs):
+                yield event, elem
+
+    def numbers(self, parent, section):
+        """Return sorted Number of each parent element (Target or
+        Observation), scanning only until the end of the section element.
+        """
+        ns = '{' + NS['apt'] + '}'
+        numbers = set()
+        for event, elem in self.iterparse(events=('end',),
+                tag=(ns+parent, ns+section)):
+            if elem.tag == ns+section:
+                break
+            number = elem.find(ns+'Number')
+            if number is not None:
+                numbers.add(number.text)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return sorted(numbers)
 
     def xmldump(self):
         for line in etree.tostring(self.root).splitlines():
             print(line)
 
+    def index(self, tag, check=False):
+        """Return dictionary of Number text to <Target> or <Observation>
+        element (tag), built with one scan of the tree on first use.
+        If check is True, rebuild the index if any entry is stale.
+        """
+        if check and tag in self._index:
+            for number, _elem in self._index[tag].items():
+                if _elem.getparent() is None or number != \
+                        _elem.findtext('apt:Number', None, NS):
+                    self._index.pop(tag)
+                    break
+        if tag not in self._index:
+            index = {}
+            root = self.root
+            with profiler.stage('xpath'):
+                for e in xpath('descendant::apt:' + tag + '/apt:Number')(root):
+                    index.setdefault(e.text, e.getparent())
+            self._index[tag] = index
+        return self._index[tag]
+
+    def lookup(self, tag, number):
+        """Return <Target> or <Observation> element with the specified
+        Number, or None. Rebuild the index if the element is stale, e.g.
+        after its Number was changed or it was removed from the tree.
+        """
+        _elem = self.index(tag).get(number)
+        if _elem is None or _elem.getparent() is None \
+                or _elem.findtext('apt:Number', None, NS) != number:
+            self._index.pop(tag)
+            _elem = self.index(tag).get(number)
+        return _elem
+
+    def replace(self, tag, elem, number):
+        """Replace element with the specified Number by elem.
+        Return False if there is no such element.
+        """
+        _old = self.lookup(tag, number)
+        if _old is None:
+            return False
+        if _old is not elem:
+            _old.getparent().replace(_old, elem)
+        self._index[tag][number] = elem
+        return True
+
     def target(self, targnum, name=None):
-        _xpath = './/apt:Target/apt:Number[text()="' + targnum + '"]'
-        _elem = self.root.xpath(_xpath, namespaces=self.ns)[0]
+        _elem = self.lookup('Target', targnum)
         if _elem is not None:
-            return Target(_elem.getparent())
+            return Target(_elem)
         else:
             return None
 
+    def targets(self):
+        """Return list of Target objects, ordered like targnums().
+        """
+        _index = self.index('Target', check=True)
+        return [Target(_index[n]) for n in sorted(_index)]
+
     def targnums(self):
-        _xpath = './/apt:Target/apt:Number'
-        targnums = sorted({e.text for e in self.root.findall(_xpath, self.ns)})
-        return targnums
+        if self._root is None:
+            return self.numbers('Target', 'Targets')
+        return sorted(self.index('Target', check=True))
 
     def observation(self, obsnum, name=None):
-        _xpath = './/apt:Observation/apt:Number[text()="' + obsnum + '"]'
-        _elem = self.root.xpath(_xpath, namespaces=self.ns)
-        if not _elem:
+        _elem = self.lookup('Observation', obsnum)
+        if _elem is None:
             raise ValueError('Proposal has no observation {}'
                     .format(obsnum))
         else:
-            return Observation(_elem[0].getparent())
+            return Observation(_elem)
+
+    def observations(self):
+        """Return list of Observation objects, ordered like obsnums().
+        """
+        _index = self.index('Observation', check=True)
+        return [Observation(_index[n]) for n in sorted(_index)]
 
     def obsnums(self):
-        _xpath = './/apt:Observation/apt:Number'
-        obsnums = sorted({e.text for e in self.root.findall(_xpath, self.ns)})
-        return obsnums
+        if self._root is None:
+            return self.numbers('Observation', 'DataRequests')
+        return sorted(self.index('Observation', check=True))
 
     def summary(self):
         print("{}='{}', {}='{}'".format(
                 'File',self.aptxfile,
                 'schemaVersion',self.schemaversion))
-        for obsnum in self.obsnums():
-            self.observation(obsnum).summary()
+        for obs in self.observations():
+            obs.summary()
+
+    def target_records(self):
+        """Return list of TargetRecord, ordered like targnums().
+        """
+        return [t.record(self.aptxfile) for t in self.targets()]
+
+    def target_table(self):
+        """Return table of targets with RA, Dec and proper motions in
+        common units. See module function target_table.
+        """
+        return target_table([self])
+
+    def observation_records(self):
+        """Return list of ObservationRecord, ordered like obsnums().
+        """
+        return [o.record(self.aptxfile) for o in self.observations()]
 
     def update(self, target=None, observation=None):
         if target is not None:
-            _xpath = './/apt:Target/apt:Number[text()="' \
-                    + target.number.text + '"]'
-            _number = self.root.xpath(_xpath, namespaces=self.ns)[0]
-            if _number is None:
+            if not self.replace('Target', target.elem, target.number.text):
                 print('Target does not exist')
-            else:
-                _oldtarg = _number.getparent()
-                _oldtarg.getparent().replace(_oldtarg, target.elem)
         if observation is not None:
-            _xpath = './/apt:Observation/apt:Number[text()="' \
-                    + observation.number.text + '"]'
-            _number = self.root.xpath(_xpath, namespaces=self.ns)[0]
-            if _number is None:
+            if not self.replace('Observation', observation.elem,
+                    observation.number.text):
                 print('Observation does not exist')
-            else:
-                _oldobs = _number.getparent()
-                _oldobs.getparent().replace(_oldobs, observation.elem)
-
-    def write(self, newfile):
-        self.zdata[self.xmlfile] = etree.tostring(self.root,
-                doctype=self.doctype)
-        with zipfile.ZipFile(newfile, 'w') as zfile:
-            for name in self.zdata.keys():
-                zfile.writestr(name, self.zdata[name])
-            zfile.close()
-
-def run(aptxfile):
+
+    def write(self, newfile, compression=zipfile.ZIP_DEFLATED):
+        """Write proposal to a new .aptx file, which may be the original.
+        The XML tree, if it was parsed, is serialized straight into a
+        compressed zip entry. Members that are unchanged since they were
+        read are copied as raw compressed bytes.
+        """
+        with zipfile.ZipFile(self.aptxfile) as zsrc:
+            infos = {info.filename: info for info in zsrc.infolist()}
+            tmpfile = newfile + '.tmp{}'.format(os.getpid())
+            try:
+                with zipfile.ZipFile(tmpfile, 'w', compression) as zfile:
+                    for name in self.zdata:
+                        if name == self.xmlfile and self._root is not None:
+                            doctype = self.doctype.decode()
+                            info = zipfile.ZipInfo(name,
+                                    time.localtime()[:6])
+                            info.compress_type = compression
+                            with zfile.open(info, 'w') as stream, \
+                                    etree.xmlfile(stream) as xf:
+                                xf.write_doctype(doctype)
+                                xf.write(self.root)
+                        elif name in infos and self.unchanged(infos[name]):
+                            copyraw(zsrc, infos[name], zfile)
+                        else:
+                            zfile.writestr(name, self.zdata[name])
+                os.replace(tmpfile, newfile)
+            finally:
+                if os.path.exists(tmpfile):
+                    os.remove(tmpfile)
+
+    def unchanged(self, info):
+        """Return True if zip member with ZipInfo info was not modified.
+        """
+        if isinstance(self.zdata, ZipMembers) \
+                and info.filename not in self.zdata.data:
+            return True
+        data = self.zdata[info.filename]
+        return len(data) == info.file_size \
+                and zipfile.crc32(data) == info.CRC
+
+def strip_extra(extra, ids):
+    """Return zip extra field data without the records whose header id is
+    in ids.
+    """
+    records = []
+    i = 0
+    while i + 4 <= len(extra):
+        hid, size = struct.unpack('<HH', extra[i:i+4])
+        if hid not in ids:
+            records.append(extra[i:i+4+size])
+        i += 4 + size
+    return b''.join(records)
+
+def copyraw(zsrc, info, zdst):
+    """Copy member with ZipInfo info from open ZipFile zsrc to ZipFile zdst
+    opened with mode 'w', without decompressing and recompressing it.
+    zipfile has no API for this, so the local header and raw data are
+    written to the output file, and the member is added to the central
+    directory, through the attributes zipfile keeps for appending. If
+    zdst does not have them, the member is recompressed with writestr.
+
+    These attributes (ZipFile.fp, start_dir, filelist, NameToInfo,
+    ZipInfo.FileHeader and zipfile.sizeFileHeader) are not documented, so
+    a new Python version could change them. tests/test_write.py checks
+    the round trip, and CI runs it on each supported Python version.
+    """
+    if not all(hasattr(zdst, a) for a in ('fp', 'start_dir', 'filelist',
+            'NameToInfo')):
+        new = copy.copy(info)
+        new.flag_bits &= ~0x08
+        zdst.writestr(new, zsrc.read(info))
+        return
+    zsrc.fp.seek(info.header_offset)
+    header = zsrc.fp.read(zipfile.sizeFileHeader)
+    namelen, extralen = struct.unpack('<HH', header[26:30])
+    zsrc.fp.seek(info.header_offset + zipfile.sizeFileHeader + namelen
+            + extralen)
+    data = zsrc.fp.read(info.compress_size)
+    new = copy.copy(info)
+    # Sizes and CRC are known, so put them in the local header instead of
+    # a data descriptor after the data. FileHeader adds a new ZIP64 extra
+    # record, if needed.
+    new.flag_bits &= ~0x08
+    new.extra = strip_extra(info.extra, (1,))
+    new.header_offset = zdst.fp.tell()
+    zdst.fp.write(new.FileHeader())
+    zdst.fp.write(data)
+    zdst.start_dir = zdst.fp.tell()
+    zdst.filelist.append(new)
+    zdst.NameToInfo[new.filename] = new
+
+def pcf_windows(pcf):
+    """Return arrays (t1, t2, a1, a2, p) of the windows in a scheduling
+    PCF string from the visit planner: start and end times in unix
+    milliseconds, V3PA range, and probability. The PCF is a sequence of
+    times, each window between two times optionally preceded by a
+    probability (e.g. 1.0) and a V3PA range (e.g. 238.5:278.3). Windows
+    without a V3PA range get 0, and windows with probability 0 (or none)
+    are dropped.
+    """
+    tokens = np.array(pcf.split(), dtype=str)
+    isangle = np.char.find(tokens, ':') >= 0
+    isprob = ~isangle & (np.char.find(tokens, '.') >= 0)
+    istime = ~isangle & ~isprob
+    ms = np.fromiter(map(int, tokens[istime]), np.int64)
+    nwin = max(len(ms) - 1, 0)
+    # Window k is defined by the tokens after the (k+1)th time. If a value
+    # occurs more than once in a window, the last one counts.
+    window = np.cumsum(istime) - 1
+    values = []
+    for mask in isprob, isangle:
+        idx = np.flatnonzero(mask & (window >= 0) & (window < nwin))
+        last = np.ones(len(idx), dtype=bool)
+        last[:-1] = window[idx][1:] != window[idx][:-1]
+        idx = idx[last]
+        values.append((window[idx], tokens[idx]))
+    p = np.zeros(nwin)
+    a1 = np.zeros(nwin)
+    a2 = np.zeros(nwin)
+    win, toks = values[0]
+    p[win] = np.fromiter(map(float, toks), float, len(toks))
+    win, toks = values[1]
+    # Some constraints (e.g. off-normal) have more than two fields. The
+    # first two are the V3PA range.
+    fields = [t.split(':') for t in toks.tolist()]
+    a1[win] = [float(f[0]) for f in fields]
+    a2[win] = [float(f[1]) for f in fields]
+    good = p > 0
+    return ms[:-1][good], ms[1:][good], a1[good], a2[good], p[good]
+
+def unixtimes(ms, tform='unix'):
+    """Convert array of unix milliseconds to tform: 'unix' (integer
+    seconds), 'isot' (string, to the second), or 'decimalyear', with a
+    single Time call.
+    """
+    from astropy.time import Time
+    if tform == 'unix':
+        return (ms / 1000).astype(np.int64)
+    t = Time(ms / 1000, format='unix')
+    if tform == 'isot':
+        isot = np.asarray(t.isot)
+        width = max(isot.dtype.itemsize // 4 - 4, 1)
+        return isot.astype('U{}'.format(width))
+    if tform == 'decimalyear':
+        return np.asarray(t.decimalyear)
+    raise ValueError('unknown time format {}'.format(tform))
+
+def gswin(prop, obsnum, tform='unix', type='guide-star'):
+    """Return table of the guide star windows of an observation, from the
+    visit planner results saved in the proposal.
+
+    Parameters
+    ----------
+    prop : Proposal or name of .aptx file
+    obsnum : observation number
+    tform : output time format: 'unix', 'isot' or 'decimalyear'
+    type : type of constraint scheduling windows
+
+    Table columns are obs, visit, tstart, tend, v3pamin, v3pamax and prob.
+    Adjacent windows of a visit with the same V3PA range and probability
+    are merged.
+    """
+    return gswins(prop, [obsnum], tform, type)
+
+def gswins(prop, obsnums=None, tform='unix', type='guide-star'):
+    """Return table of the guide star windows of several observations,
+    like gswin. The proposal and each visit planner result are parsed once
+    and all times are converted together. If obsnums is None, use every
+    observation that has visit planner results.
+    """
+    from astropy.table import Table
+    if not isinstance(prop, Proposal):
+        prop = Proposal(prop)
+    if obsnums is None:
+        observations = prop.observations()
+    else:
+        observations = [prop.observation('{}'.format(n)) for n in obsnums]
+    toolvalue = xpath('descendant::apt:ToolValue')
+    vswpath = etree.XPath('descendant::StVisitSchedulingWindows')
+    gspath = etree.XPath('descendant::StVisitSchedulingWindows'
+            '/StConstraintSchedulingWindows[@Type=$type]')
+    ids, windows = [], []
+    for obs in observations:
+        toolvalues = toolvalue(obs.elem)
+        if not toolvalues:
+            if obsnums is None:
+                continue
+            raise ValueError('Observation {} has no visit planner data'
+                    .format(obs.number.text))
+        for e in toolvalues:
+            tag, progid, obsid, visid = e.get('Name').split(':')
+            with profiler.stage('xml parse'):
+                vp = etree.fromstring(e.text)
+            if vswpath(vp)[0].get('UpToDate') == 'false':
+                raise ValueError('Observation {} is not up to date.'
+                        ' Run visit planner.'.format(obs.number.text))
+            pcf = gspath(vp, type=type)[0].get('StSchedulingPCF')
+            with profiler.stage('pcf parse'):
+                win = pcf_windows(pcf)
+            ids.append(np.full((len(win[0]), 2), (int(obsid), int(visid))))
+            windows.append(win)
+    names = ('obs', 'visit', 'tstart', 'tend', 'v3pamin', 'v3pamax', 'prob')
+    if not windows:
+        return Table([np.zeros(0, int), np.zeros(0, int),
+                unixtimes(np.zeros(0, np.int64), tform),
+                unixtimes(np.zeros(0, np.int64), tform), np.zeros(0),
+                np.zeros(0), np.zeros(0)], names=names)
+    ids = np.concatenate(ids)
+    visit = np.repeat(np.arange(len(windows)), [len(w[0]) for w in windows])
+    ms1, ms2, a1, a2, p = [np.concatenate(w) for w in zip(*windows)]
+    # Most windows start when the previous one ends, so convert each
+    # distinct time only once.
+    ms, inverse = np.unique(np.concatenate([ms1, ms2]), return_inverse=True)
+    with profiler.stage('time conversion'):
+        t = unixtimes(ms, tform)[inverse]
+    t1, t2 = t[:len(ms1)], t[len(ms1):]
+    # Merge each window into the previous one of the same visit, if it
+    # starts when that one ends and has the same V3PA range and probability.
+    merge = (visit[1:] == visit[:-1]) & (t1[1:] == t2[:-1]) \
+            & (a1[1:] == a1[:-1]) & (a2[1:] == a2[:-1]) & (p[1:] == p[:-1])
+    first = np.flatnonzero(np.append(True, ~merge)) if len(p) else \
+            np.zeros(0, int)
+    last = np.append(first[1:] - 1, len(p) - 1).astype(int)
+    return Table([ids[first, 0], ids[first, 1], t1[first], t2[last],
+            a1[first], a2[first], p[first]], names=names)
+
+def read_gswin(gswinfile):
+    """Return table of the windows in a .gswin file written by
+    aptx_gswin.py, with the same columns as gswin(). Times are integers
+    (unix), floats (decimalyear) or strings (isot), as in the file.
+    """
+    from astropy.table import Table
+    with open(gswinfile) as f:
+        cols = list(zip(*[line.split() for line in f])) or [()] * 7
+    tdtype = 'i8'
+    if cols[2]:
+        tdtype = 'U' if 'T' in cols[2][0] else 'f8' if '.' in cols[2][0] \
+                else 'i8'
+    dtypes = ('i8', 'i8', tdtype, tdtype, 'f8', 'f8', 'f8')
+    return Table([np.array(c, dtype=d) for c, d in zip(cols, dtypes)],
+            names=('obs', 'visit', 'tstart', 'tend', 'v3pamin', 'v3pamax',
+            'prob'))
+
+def arcs_overlap(lo1, hi1, lo2, hi2):
+    """Return True where V3PA range lo1:hi1 overlaps range lo2:hi2, in
+    degrees. A range wraps through 360 if hi < lo.
+    """
+    len1 = (hi1 - lo1) % 360
+    len2 = (hi2 - lo2) % 360
+    return ((lo2 - lo1) % 360 <= len1) | ((lo1 - lo2) % 360 <= len2)
+
+def union(t1, t2):
+    """Return arrays (start, end) of the union of intervals t1:t2, as
+    sorted, disjoint intervals.
+    """
+    order = np.argsort(t1, kind='stable')
+    t1, t2 = t1[order], np.maximum.accumulate(t2[order])
+    first = np.flatnonzero(np.append(True, t1[1:] > t2[:-1]))
+    last = np.append(first[1:] - 1, len(t1) - 1)
+    return t1[first], t2[last]
+
+class WindowIndex:
+    """Index of scheduling windows (obs, visit, tstart, tend, V3PA range,
+    probability) from gswins() or .gswin files, for fast queries by time.
+
+    Windows are grouped by duration, in factors of two, and sorted by start
+    time within each group. A window in a group can start at most the
+    group's longest duration before a query time, so each query is a
+    binary search per group, and scans few windows that do not match.
+    Windows are closed intervals, so adjacent windows both match at the
+    time they meet.
+
+    Parameters
+    ----------
+    windows : Table like gswins() returns, or name(s) of .gswin files.
+        Times in isot format are converted to unix seconds.
+    """
+
+    def __init__(self, windows):
+        from astropy.table import Table, vstack
+        from astropy.time import Time
+        if isinstance(windows, str):
+            windows = [windows]
+        if not isinstance(windows, Table):
+            windows = vstack([read_gswin(f) for f in windows])
+        if windows['tstart'].dtype.kind in 'US':
+            windows = windows.copy()
+            for name in 'tstart', 'tend':
+                windows[name] = Time(np.asarray(windows[name]),
+                        format='isot', scale='utc').unix
+        self.windows = windows
+        t1 = np.asarray(windows['tstart'], float)
+        t2 = np.asarray(windows['tend'], float)
+        group = np.frexp(t2 - t1)[1]
+        self.order = np.lexsort((t1, group))
+        group = group[self.order]
+        self.t1 = t1[self.order]
+        self.t2 = t2[self.order]
+        bounds = np.flatnonzero(np.diff(group)) + 1
+        self.groups = [(lo, hi, (self.t2[lo:hi] - self.t1[lo:hi]).max())
+                for lo, hi in zip(np.append(0, bounds),
+                np.append(bounds, len(group))) if hi > lo]
+        self.pamin = np.asarray(windows['v3pamin'], float)[self.order]
+        self.pamax = np.asarray(windows['v3pamax'], float)[self.order]
+        self.visit = (np.asarray(windows['obs'], np.int64) << 32
+                | np.asarray(windows['visit'], np.int64))[self.order]
+        self.byvisit = None
+
+    def __len__(self):
+        return len(self.t1)
+
+    def search(self, t1, t2, pa=None):
+        """Return sorted positions in the index of windows that overlap
+        t1:t2, and V3PA range pa=(min, max), if given.
+        """
+        found = []
+        for lo, hi, maxlen in self.groups:
+            i0 = lo + np.searchsorted(self.t1[lo:hi], t1 - maxlen, 'left')
+            i1 = lo + np.searchsorted(self.t1[lo:hi], t2, 'right')
+            idx = np.arange(i0, i1)
+            found.append(idx[self.t2[idx] >= t1])
+        idx = np.concatenate(found) if found else np.zeros(0, int)
+        if pa is not None:
+            idx = idx[arcs_overlap(self.pamin[idx], self.pamax[idx], *pa)]
+        return np.sort(idx)
+
+    def at(self, t, pa=None):
+        """Return table of windows that contain time t, and overlap V3PA
+        range pa=(min, max), if given.
+        """
+        return self.windows[np.sort(self.order[self.search(t, t, pa)])]
+
+    def during(self, t1, t2, pa=None):
+        """Return table of windows that overlap times t1:t2, and V3PA range
+        pa=(min, max), if given.
+        """
+        return self.windows[np.sort(self.order[self.search(t1, t2, pa)])]
+
+    def visits(self, t, pa=None):
+        """Return list of (obs, visit) schedulable at time t, with V3PA
+        range pa=(min, max), if given.
+        """
+        keys = np.unique(self.visit[self.search(t, t, pa)])
+        return [(int(k >> 32), int(k & 0xffffffff)) for k in keys]
+
+    def common(self, visits, t1=-float('inf'), t2=float('inf'), pa=None):
+        """Return arrays (start, end) of the time intervals within t1:t2
+        when all visits, a list of (obs, visit), are schedulable, with
+        V3PA range pa=(min, max), if given.
+        """
+        if self.byvisit is None:
+            self.byvisit = np.lexsort((self.t1, self.visit))
+            self.visitkeys = self.visit[self.byvisit]
+        keys = self.visitkeys
+        starts, ends = [], []
+        for obs, visit in visits:
+            key = obs << 32 | visit
+            lo = np.searchsorted(keys, key, 'left')
+            hi = np.searchsorted(keys, key, 'right')
+            sel = self.byvisit[lo:hi]
+            sel = sel[(self.t1[sel] <= t2) & (self.t2[sel] >= t1)]
+            if pa is not None:
+                sel = sel[arcs_overlap(self.pamin[sel], self.pamax[sel], *pa)]
+            start, end = union(np.clip(self.t1[sel], t1, t2),
+                    np.clip(self.t2[sel], t1, t2))
+            starts.append(start)
+            ends.append(end)
+        if not starts:
+            return np.zeros(0), np.zeros(0)
+        # Sweep over interval starts and ends, counting visits that are
+        # schedulable. Starts sort before ends at equal times.
+        times = np.concatenate(starts + ends)
+        step = np.concatenate([np.ones(sum(map(len, starts)), int),
+                -np.ones(sum(map(len, ends)), int)])
+        order = np.lexsort((-step, times))
+        times, count = times[order], np.cumsum(step[order])
+        inside = np.flatnonzero(count == len(visits))
+        return times[inside], times[inside + 1]
+
+# Result of applying a function to one file in a batch.
+BatchResult = namedtuple('BatchResult', 'aptxfile result output error')
+
+def batchcall(func, aptxfile):
+    """Return BatchResult for func(aptxfile). Capture printed output.
+    Catch exceptions, so one bad file does not abort a batch.
+    """
+    out = StringIO()
+    try:
+        with redirect_stdout(out):
+            result = func(aptxfile)
+        error = None
+    except Exception as e:
+        result = None
+        error = '{}: {}'.format(type(e).__name__, e)
+    return BatchResult(aptxfile, result, out.getvalue(), error)
+
+def batch(func, aptxfiles, jobs=1, report=True, server=False):
+    """Apply func to each .aptx file, in a pool of worker processes.
+
+    Parameters
+    ----------
+    func : module-level function that takes the name of an .aptx file
+    aptxfiles : list of .aptx file names
+    jobs : number of worker processes (1 runs in this process)
+    report : print number of files, errors and throughput to stderr
+    server : with jobs 1, ask aptx_server.py to apply func, if it is
+        running and can apply it. It applies one request at a time, so
+        more jobs run locally.
+
+    Yields BatchResult for each file, in the order of aptxfiles, with
+    the return value, printed output, and error message (or None).
+    """
+    aptxfiles = list(aptxfiles)
+    nerror = 0
+    t0 = time.perf_counter()
+    res = served(func, aptxfiles[0]) if server and aptxfiles and jobs <= 1 \
+            else None
+    if res is not None:
+        for i, aptxfile in enumerate(aptxfiles):
+            if i:
+                res = served(func, aptxfile) or batchcall(func, aptxfile)
+            nerror += res.error is not None
+            yield res
+    elif jobs > 1 and len(aptxfiles) > 1:
+        chunksize = max(1, min(64, len(aptxfiles) // (4 * jobs)))
+        with ProcessPoolExecutor(jobs) as pool:
+            results = pool.map(batchcall, [func]*len(aptxfiles), aptxfiles,
+                    chunksize=chunksize)
+            for res in results:
+                nerror += res.error is not None
+                yield res
+    else:
+        for aptxfile in aptxfiles:
+            res = batchcall(func, aptxfile)
+            nerror += res.error is not None
+            yield res
+    if report:
+        dt = time.perf_counter() - t0
+        print('{} files, {} errors, {:.2f} s, {:.1f} files/s'.format(
+                len(aptxfiles), nerror, dt, len(aptxfiles) / max(dt, 1e-9)),
+                file=sys.stderr)
+
+def summary(aptxfile):
+    """Print summary of an .aptx file. For use with batch.
+    """
+    Proposal(aptxfile).summary()
+
+def schemaversion(aptxfile):
+    """Return schema version of an .aptx file. For use with batch.
+    """
+    return Proposal(aptxfile, lazy=True).schemaversion
+
+def records(aptxfile):
+    """Return lists of TargetRecord and ObservationRecord for an .aptx
+    file. For use with batch, to collect records from many proposals.
+    """
+    prop = Proposal(aptxfile)
+    return prop.target_records(), prop.observation_records()
+
+def edit(aptxfile, func, outdir=None):
+    """Apply func(prop) to the Proposal in an .aptx file, e.g. to call
+    Target.update and Proposal.update, then write it back, or to a file
+    of the same name in outdir. Return what func returns. For use with
+    batch_edit.
+    """
+    prop = Proposal(aptxfile, lazy=True)
+    result = func(prop)
+    newfile = aptxfile if outdir is None \
+            else os.path.join(outdir, os.path.basename(aptxfile))
+    prop.write(newfile)
+    return result
+
+def batch_edit(func, aptxfiles, outdir=None, jobs=1, report=True):
+    """Apply func(prop) to each .aptx file and write the edited proposals,
+    in place or to outdir, in a pool of worker processes. func must be a
+    module-level function (or functools.partial of one) to run with
+    jobs > 1. Yields BatchResult for each file, like batch.
+    """
+    return batch(functools.partial(edit, func=func, outdir=outdir),
+            aptxfiles, jobs=jobs, report=report)
+
+def aptpath():
+    """Return path of the APT executable in $APTDIR, or else in the last
+    (newest) APT* directory in /Applications.
+    """
     aptdir = os.getenv('APTDIR')
     if aptdir is None:
         stddir = '/Applications'
         dirs = os.listdir(stddir)
-        adirs = filter(lambda dir: dir.startswith('APT'), dirs)
+        adirs = sorted(filter(lambda dir: dir.startswith('APT'), dirs))
         if adirs:
             aptdir = os.path.join(stddir,adirs[-1])
-    apt = os.path.join(aptdir,'bin','apt')
-    cmd = [apt,'-mode','STScI','-nogui','-nobackups', '-runall',
+    return os.path.join(aptdir,'bin','apt')
+
+def aptcmd(aptxfile):
+    """Return APT command that exports pointing, times and smart accounting
+    files for an .aptx file.
+    """
+    return [aptpath(),'-mode','STScI','-nogui','-nobackups', '-runall',
             '-export','pointing,times,smart_accounting',aptxfile]
+
+# Suffixes of the files that aptcmd makes APT export.
+_EXPORTS = {'pointing': '.pointing', 'times': '.times',
+        'smart_accounting': '.smart_accounting'}
+
+def exportfiles(aptxfile):
+    """Return dictionary of the pointing, times and smart accounting files
+    that APT exports next to an .aptx file.
+    """
+    root = os.path.splitext(aptxfile)[0]
+    return {name: root+suffix for name, suffix in _EXPORTS.items()}
+
+def run(aptxfile, cache=None):
+    """Run APT on an .aptx file, print its output and return its exit
+    status. With an ExportCache, restore the exports of an unchanged
+    proposal from the cache instead, and store the exports of a successful
+    run in it.
+    """
+    if cache is not None:
+        key = cache.key(aptxfile)
+        result = cache.get(aptxfile, key, parse=False)
+        if result is not None:
+            print(result.output)
+            return result.returncode
+    cmd = aptcmd(aptxfile)
+    started = time.time()
     try:
-        output = subprocess.check_output(cmd)
+        with profiler.stage('apt run'):
+            output = subprocess.check_output(cmd)
         print(output)
         returncode = 0
     except subprocess.CalledProcessError as e:
         output = e.output
         returncode = e.returncode
         print(output)
+    if cache is not None and returncode == 0:
+        cache.put(aptxfile, key, AptResult(aptxfile, returncode, output, 1,
+                None, None, None), started)
+    return returncode
+
+def table_from_rows(rows, names, dtypes):
+    """Return astropy table built in one step from a list of rows, each a
+    list of strings. Transpose rows into columns, then convert each column
+    with one call: map and numpy.fromiter for numbers, numpy.array for
+    byte strings. A value of None in a float column becomes NaN.
+    """
+    from astropy.table import Table
+    with profiler.stage('table build'):
+        cols = list(zip(*rows)) if rows else [()] * len(names)
+        arrays = []
+        for col, dtype in zip(cols, dtypes):
+            if dtype.startswith('S'):
+                arrays.append(np.array(col, dtype=dtype))
+            elif dtype.startswith('f'):
+                if None in col:
+                    col = ['nan' if v is None else v for v in col]
+                arrays.append(np.fromiter(map(float, col), dtype, len(col)))
+            else:
+                arrays.append(np.fromiter(map(int, col), dtype, len(col)))
+        return Table(arrays, names=names)
 
 def pointing(pfile):
+    """Read pointing file exported by APT. Return astropy table with one
+    row per pointing. Rows with 21 columns lack ddist, which is NaN.
+    """
     _pnames = ('obsnum','visnum','targ','tile','expnum','dith',
             'aperture','targnum','propname','radeg','decdeg','xbase',
             'ybase','xdith','ydith','v2','v3','xidl',
@@ -276,44 +1336,424 @@ def pointing(pfile):
             'S99','i4','S99','f8','f8','f4',
             'f4','f4','f4','f4','f4','f4',
             'f4','S99','S99','i4','i4','f4')
-    point = Table(names=_pnames, dtype=_pdtype)
-    with open(pfile, 'r') as file:
+    rows = []
+    with profiler.stage('pointing read'), open(pfile, 'r') as file:
         for line in file:
             words = line.split()
             if line.startswith('** Visit '):
                 obsnum,visnum = line[9:].strip().split(':')
             elif len(words)==21 and words[0].isdigit():
-                point.add_row([obsnum,visnum]+line.split()+[None])
+                rows.append([obsnum,visnum]+words+[None])
             elif len(words)==22 and words[0].isdigit():
-                point.add_row([obsnum,visnum]+line.split())
-    return point
+                rows.append([obsnum,visnum]+words)
+    return table_from_rows(rows, _pnames, _pdtype)
 
-def times(tfile):
-    _onames = ('obsnum','scidur','tcharge')
-    _odtype = ('i4','i4', 'i4')
-    obs = Table(names=_onames, dtype=_odtype)
-    _vnames = ('obsnum','visnum','pdist','scidur','instoh','sam',
-            'tslew','obsoh','schedoh','tcharge')
-    _vdtype = ('i4','i4', 'f4','i4','i4','i4',
-            'i4','i4','i4','i4')
-    visit = Table(names=_vnames, dtype=_vdtype)
-    _enames = ('obsnum','expnum','subarr','readout','tframe','ngroup',
-            'nframe','grpgap','nint','tphotc','ndith','pdith',
-            'sdith','nexp','tphot','expdur','exping')
-    _edtype = ('i4','i4','S99','S99','f4','i4',
-            'i4','i4','i4','f4','i4','i4',
-            'i4','i4','f4','i4','i4')
-    expo = Table(names=_enames, dtype=_edtype)
+# Schema of the observation, visit and exposure tables in a .times file.
+_onames = ('obsnum','scidur','tcharge')
+_odtype = ('i4','i4', 'i4')
+_vnames = ('obsnum','visnum','pdist','scidur','instoh','sam',
+        'tslew','obsoh','schedoh','tcharge')
+_vdtype = ('i4','i4', 'f4','i4','i4','i4',
+        'i4','i4','i4','i4')
+_enames = ('obsnum','expnum','subarr','readout','tframe','ngroup',
+        'nframe','grpgap','nint','tphotc','ndith','pdith',
+        'sdith','nexp','tphot','expdur','exping')
+_edtype = ('i4','i4','S99','S99','f4','i4',
+        'i4','i4','i4','f4','i4','i4',
+        'i4','i4','f4','i4','i4')
+
+# Translation table that deletes parentheses around values in visit lines.
+_noparens = str.maketrans('', '', '()')
+
+def times_rows(tfile):
+    """Yield obsnum and lists of observation, visit and exposure rows
+    (each a list of strings) for each observation in a .times file.
+    """
+    obsnum = None
+    orows, vrows, erows = [], [], []
     with open(tfile, 'r') as file:
         for line in file:
             words = line.split()
             if line.startswith('* Observation '):
-                obsnum = line.split()[-1]
+                if obsnum is not None:
+                    yield obsnum, orows, vrows, erows
+                    orows, vrows, erows = [], [], []
+                obsnum = words[-1]
             elif len(words)==2 and words[0].isdigit():
-                obs.add_row([obsnum]+line.split())
+                orows.append([obsnum]+words)
             elif len(words)==16 and words[0].isdigit():
-                expo.add_row([obsnum]+line.split())
+                erows.append([obsnum]+words)
             elif len(words)>9 and words[0].isdigit():
-                line2 = line.replace('(','').replace(')','')
-                visit.add_row([obsnum]+line2.split())
+                vrows.append([obsnum]+line.translate(_noparens).split())
+    if obsnum is not None:
+        yield obsnum, orows, vrows, erows
+
+def times(tfile):
+    """Read times file exported by APT. Return astropy tables of
+    observations, visits and exposures, each built once at the end.
+    """
+    orows, vrows, erows = [], [], []
+    with profiler.stage('times read'):
+        for obsnum, o, v, e in times_rows(tfile):
+            orows.extend(o)
+            vrows.extend(v)
+            erows.extend(e)
+    obs = table_from_rows(orows, _onames, _odtype)
+    visit = table_from_rows(vrows, _vnames, _vdtype)
+    expo = table_from_rows(erows, _enames, _edtype)
     return obs,visit,expo
+
+def iter_times(tfile):
+    """Yield obsnum and astropy tables of observations, visits and
+    exposures for each observation, as soon as it has been read from
+    the .times file. Tables have the same columns as those from times().
+    """
+    for obsnum, o, v, e in times_rows(tfile):
+        yield (int(obsnum), table_from_rows(o, _onames, _odtype),
+                table_from_rows(v, _vnames, _vdtype),
+                table_from_rows(e, _enames, _edtype))
+
+# Result of running APT on one .aptx file with run_batch. The pointing
+# and times fields hold the parsed exports, if requested and present.
+AptResult = namedtuple('AptResult', ('aptxfile', 'returncode', 'output',
+        'attempts', 'pointing', 'times', 'error'))
+
+def parse_exports(aptxfile):
+    """Return pointing table and times tables read from the files that APT
+    exported for an .aptx file.
+    """
+    files = exportfiles(aptxfile)
+    return pointing(files['pointing']), times(files['times'])
+
+async def runjob(aptxfile, limit, timeout=None, retries=0, parse=True,
+        log=None, cache=None):
+    """Run APT on one .aptx file, once the limit semaphore allows it.
+    Capture output line by line, passing each line to log(aptxfile, line)
+    as it arrives. Kill APT after timeout seconds. Retry a failed or timed
+    out run up to retries times. Then parse the exported files. With an
+    ExportCache, serve an unchanged proposal from the cache, and store the
+    exports of a successful run in it.
+    Return AptResult. Catch exceptions, e.g. a missing APT executable or
+    an .aptx file that is not a zip file, so one bad input does not abort
+    run_batch.
+    """
+    try:
+        return await _runjob(aptxfile, limit, timeout, retries, parse, log,
+                cache)
+    except Exception as e:
+        return AptResult(aptxfile, None, b'', 0, None, None,
+                '{}: {}'.format(type(e).__name__, e))
+
+async def _runjob(aptxfile, limit, timeout, retries, parse, log, cache):
+    """Do the work of runjob, without catching exceptions.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if cache is not None:
+        key = await loop.run_in_executor(None, cache.key, aptxfile)
+        result = await loop.run_in_executor(None, cache.get, aptxfile,
+                key, parse)
+        if result is not None:
+            return result
+    async with limit:
+        started = time.time()
+        for attempt in range(1, retries+2):
+            proc = await asyncio.create_subprocess_exec(*aptcmd(aptxfile),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    start_new_session=True)
+            lines = []
+
+            async def capture():
+                async for line in proc.stdout:
+                    lines.append(line)
+                    if log is not None:
+                        log(aptxfile, line)
+                return await proc.wait()
+
+            try:
+                returncode = await asyncio.wait_for(capture(), timeout)
+                error = None if returncode == 0 \
+                        else 'APT exit status {}'.format(returncode)
+            except asyncio.TimeoutError:
+                # bin/apt is a launcher script, so kill its children too.
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                returncode = None
+                error = 'APT timed out after {} s'.format(timeout)
+            if error is None:
+                break
+    output = b''.join(lines)
+    if error is not None:
+        return AptResult(aptxfile, returncode, output, attempt,
+                None, None, error)
+    point, tables = None, None
+    if parse:
+        try:
+            point, tables = await loop.run_in_executor(None, parse_exports,
+                    aptxfile)
+        except (OSError, ValueError) as e:
+            return AptResult(aptxfile, returncode, output, attempt,
+                    None, None, 'error parsing exports: {}'.format(e))
+    result = AptResult(aptxfile, returncode, output, attempt, point, tables,
+            None)
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, aptxfile, key, result,
+                started)
+    return result
+
+def run_batch(aptxfiles, jobs=4, timeout=None, retries=1, parse=True,
+        log=None, cache=None):
+    """Run APT on many .aptx files, at most jobs at a time, with asyncio.
+
+    Parameters
+    ----------
+    aptxfiles : list of .aptx file names
+    jobs : maximum number of concurrent APT processes
+    timeout : seconds after which an APT process is killed (None: never)
+    retries : number of times to rerun APT after a failure or timeout
+    parse : if True, read exported pointing and times files with pointing()
+        and times(), as soon as each APT run finishes
+    log : optional function log(aptxfile, line) called with each line of
+        APT output (bytes) as it arrives
+    cache : optional ExportCache. Proposals whose XML is unchanged since a
+        previous run with the same APT version are not rerun. Their export
+        files are restored from the cache instead.
+
+    Returns list of AptResult, in the order of aptxfiles.
+    """
+    import asyncio
+
+    async def main():
+        limit = asyncio.Semaphore(jobs)
+        return await asyncio.gather(*[runjob(aptxfile, limit, timeout,
+                retries, parse, log, cache) for aptxfile in aptxfiles])
+    return asyncio.run(main())
+
+def aptversion():
+    """Return a string that identifies the installed APT: the name of its
+    directory (e.g. APT 25.1) and the size and mtime of bin/apt.
+    """
+    apt = aptpath()
+    stat = os.stat(apt)
+    aptdir = os.path.dirname(os.path.dirname(os.path.abspath(apt)))
+    return '{} {} {}'.format(os.path.basename(aptdir), stat.st_size,
+            stat.st_mtime_ns)
+
+class ExportCache:
+    """On-disk cache of the files APT exports for a proposal (pointing,
+    times, smart accounting) and of their parsed tables.
+
+    An entry is keyed on the sha1 hash of the proposal XML in the .aptx
+    file and the APT version, so a proposal that was only renamed, or
+    re-zipped, is still found. Entries are evicted least recently used
+    first, once there are more than maxentries or they take more than
+    maxbytes. Hit, miss and eviction counts are kept in stats.
+
+    Parameters
+    ----------
+    cachedir : directory of the cache (default $APTX_EXPORT_CACHE or
+        ~/.cache/aptx_exports)
+    maxbytes : maximum total size of cached files
+    maxentries : maximum number of cached proposals (None: no limit)
+    version : APT version string (default aptversion())
+    """
+
+    def __init__(self, cachedir=None, maxbytes=1 << 30, maxentries=None,
+            version=None):
+        if cachedir is None:
+            cachedir = os.getenv('APTX_EXPORT_CACHE') or os.path.join(
+                    os.path.expanduser('~'), '.cache', 'aptx_exports')
+        self.dir = cachedir
+        self.maxbytes = maxbytes
+        self.maxentries = maxentries
+        self.version = aptversion() if version is None else version
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(self.dir, exist_ok=True)
+
+    def key(self, aptxfile):
+        """Return cache key of an .aptx file.
+        """
+        zdata = ZipMembers(aptxfile)
+        sha1 = hashlib.sha1(self.version.encode())
+        with zdata.open(xmlname(aptxfile, zdata.names)) as stream:
+            for block in iter(lambda: stream.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def entries(self):
+        """Return list of (last use, size, directory) of cache entries,
+        oldest first.
+        """
+        entries = []
+        for key in os.listdir(self.dir):
+            if key.startswith('.'):
+                continue
+            entry = os.path.join(self.dir, key)
+            try:
+                with open(os.path.join(entry, 'manifest.json')) as f:
+                    manifest = json.load(f)
+                used = os.stat(os.path.join(entry, 'manifest.json')).st_mtime
+            except (OSError, ValueError):
+                continue
+            entries.append((used, manifest['size'], entry))
+        return sorted(entries)
+
+    def get(self, aptxfile, key=None, parse=True):
+        """Return AptResult for an .aptx file from the cache, after copying
+        its export files next to the .aptx file, or None if not cached.
+        """
+        key = self.key(aptxfile) if key is None else key
+        entry = os.path.join(self.dir, key)
+        try:
+            with open(os.path.join(entry, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            self.stats['misses'] += 1
+            return None
+        root = os.path.splitext(aptxfile)[0]
+        # Entries of older versions may list other files. Restore only
+        # known export files, never an .aptx file.
+        for suffix in set(manifest['files']) & set(_EXPORTS.values()):
+            shutil.copyfile(os.path.join(entry, 'files', suffix), root+suffix)
+        with open(os.path.join(entry, 'output'), 'rb') as f:
+            output = f.read()
+        point, tables = None, None
+        if parse:
+            tablefile = os.path.join(entry, 'tables.pickle')
+            if os.path.exists(tablefile):
+                with open(tablefile, 'rb') as f:
+                    point, tables = pickle.load(f)
+            else:
+                point, tables = parse_exports(aptxfile)
+        os.utime(os.path.join(entry, 'manifest.json'))
+        self.stats['hits'] += 1
+        return AptResult(aptxfile, 0, output, 0, point, tables, None)
+
+    def put(self, aptxfile, key, result, since=0):
+        """Store the export files of a successful APT run on an .aptx file,
+        i.e. the files of exportfiles() that were written after time since,
+        and the parsed tables of its AptResult. Then evict old entries.
+        """
+        root = os.path.splitext(aptxfile)[0]
+        suffixes = [s for s in _EXPORTS.values() if os.path.exists(root+s)
+                and os.path.getmtime(root+s) >= since - 1]
+        entry = os.path.join(self.dir, key)
+        # Unique hidden name, because run_batch stores results from
+        # several threads, possibly for copies of the same proposal.
+        tmpentry = tempfile.mkdtemp(prefix='.' + key + '.', dir=self.dir)
+        os.makedirs(os.path.join(tmpentry, 'files'))
+        for suffix in suffixes:
+            shutil.copyfile(root+suffix, os.path.join(tmpentry, 'files',
+                    suffix))
+        with open(os.path.join(tmpentry, 'output'), 'wb') as f:
+            f.write(result.output)
+        if result.pointing is not None:
+            with open(os.path.join(tmpentry, 'tables.pickle'), 'wb') as f:
+                pickle.dump((result.pointing, result.times), f)
+        size = sum(os.path.getsize(os.path.join(path, name))
+                for path, dirs, names in os.walk(tmpentry) for name in names)
+        with open(os.path.join(tmpentry, 'manifest.json'), 'w') as f:
+            json.dump({'aptxfile': os.path.abspath(aptxfile),
+                    'version': self.version, 'files': suffixes,
+                    'size': size}, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.replace(tmpentry, entry)
+        except OSError:
+            # Another run stored the same entry first.
+            shutil.rmtree(tmpentry, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within
+        maxentries and maxbytes.
+        """
+        entries = self.entries()
+        total = sum(size for used, size, entry in entries)
+        while entries and (total > self.maxbytes or (self.maxentries
+                is not None and len(entries) > self.maxentries)):
+            used, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """Remove all entries.
+        """
+        for used, size, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+def server_address():
+    """Return path of the Unix socket of aptx_server.py: $APTX_SERVER, or
+    aptx_server-UID.sock in $XDG_RUNTIME_DIR or $TMPDIR. Return None if
+    $APTX_SERVER is set to an empty string, to never use a server.
+    """
+    address = os.environ.get('APTX_SERVER')
+    if address is None:
+        address = os.path.join(os.environ.get('XDG_RUNTIME_DIR')
+                or os.environ.get('TMPDIR') or '/tmp',
+                'aptx_server-{}.sock'.format(os.getuid()))
+    return address or None
+
+def send_msg(sock, obj):
+    """Send pickled object on a socket, prefixed by its length.
+    """
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack('!Q', len(data)) + data)
+
+def recv_msg(sock):
+    """Return object sent on a socket with send_msg.
+    """
+    with sock.makefile('rb') as f:
+        head = f.read(8)
+        if len(head) == 8:
+            size, = struct.unpack('!Q', head)
+            data = f.read(size)
+            if len(data) == size:
+                return pickle.loads(data)
+    raise EOFError('connection closed')
+
+def server_request(op, path, **kwargs):
+    """Ask a running aptx_server.py to apply op to an .aptx or .sql file.
+    Return BatchResult, or None if no server is listening. Only connect to
+    a socket owned by this user, because replies are unpickled.
+    """
+    address = server_address()
+    if address is None:
+        return None
+    import socket
+    try:
+        if os.stat(address).st_uid != os.getuid():
+            return None
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(address)
+            send_msg(sock, (op, os.path.abspath(path), path, kwargs))
+            reply = recv_msg(sock)
+    except (OSError, EOFError):
+        return None
+    return BatchResult(path, *reply)
+
+def served(func, aptxfile):
+    """Return BatchResult for func(aptxfile) from a running aptx_server.py,
+    which keeps parsed proposals in memory, or None if func is not one
+    the server can apply or no server is listening. func may also be a
+    functools.partial of gswins with keyword arguments.
+    """
+    kwargs = {}
+    if isinstance(func, functools.partial) and not func.args:
+        func, kwargs = func.func, func.keywords
+    try:
+        op = _served[func]
+    except (KeyError, TypeError):
+        return None
+    if kwargs and op != 'gswins':
+        return None
+    return server_request(op, aptxfile, **kwargs)
+
+# Batch functions that aptx_server.py applies to its cached proposals.
+_served = {summary: 'summary', schemaversion: 'schemaversion',
+        records: 'records', gswins: 'gswins'}
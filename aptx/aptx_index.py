@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import aptx
+
+# Width in degrees of the declination bands used as spatial index.
+BAND = 0.5
+
+SCHEMA = '''
+create table if not exists files (
+    id integer primary key, path text unique, mtime integer, size integer,
+    sha1 text);
+create table if not exists targets (
+    file integer, number text, propname text, archname text,
+    ra real, dec real, pmra real, pmdec real, band integer);
+create table if not exists observations (
+    file integer, number text, targetnum text, targetid text,
+    instrument text, templateid text, templatename text,
+    mosaic_rows integer, mosaic_columns integer, mosaic_rowoverlap real,
+    mosaic_coloverlap real, mosaic_xskew real, mosaic_yskew real);
+create index if not exists targets_band on targets (band, ra);
+create index if not exists targets_file on targets (file, number);
+create index if not exists observations_file on observations (file, targetnum);
+create index if not exists observations_instrument on observations
+    (instrument, templatename);
+'''
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Index targets, observations and mosaics of .aptx files'
+                ' in an SQLite database, and query it by position,'
+                ' instrument and template.',
+        epilog='example: aptx_index.py apt.db index *.aptx; '
+                'aptx_index.py apt.db query --pos "05 35 0 -05 28 20" '
+                '--radius 5 --instrument NIRCAM --template NircamImaging')
+    parser.add_argument('db', help='name of SQLite database file')
+    parser.add_argument('--profile', metavar='FILE',
+            help='write per-stage timing and memory to JSON FILE, or'
+            ' cProfile dump if FILE ends with .prof')
+    sub = parser.add_subparsers(dest='command', required=True)
+    index = sub.add_parser('index', help='add new or changed .aptx files')
+    index.add_argument('aptxfiles', nargs='+', help='names of .aptx files')
+    index.add_argument('--jobs', type=int, default=1,
+            help='number of files to read in parallel')
+    index.add_argument('--prune', action='store_true',
+            help='remove indexed files that no longer exist')
+    query = sub.add_parser('query', help='list matching observations')
+    query.add_argument('--pos', help='position: RA and Dec in degrees, or'
+            ' sexagesimal "hh mm ss dd mm ss"')
+    query.add_argument('--radius', type=float, default=5.0,
+            help='search radius in arcmin (default 5)')
+    query.add_argument('--instrument', help='instrument, e.g. NIRCAM')
+    query.add_argument('--template', help='template name or ID, e.g.'
+            ' NircamImaging')
+    return parser.parse_args()
+
+def connect(db):
+    """Return connection to database, creating tables if needed.
+    """
+    con = sqlite3.connect(db)
+    con.executescript(SCHEMA)
+    return con
+
+def filehash(path):
+    """Return sha1 hash of the contents of a file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def changed(con, paths):
+    """Return list of (path, stat, sha1) for files that are not indexed or
+    whose contents changed, and number of files that could not be read.
+    Files with a new mtime but the same hash only get their mtime updated.
+    """
+    todo = []
+    nerror = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            row = con.execute('select mtime, size, sha1 from files'
+                    ' where path = ?', (path,)).fetchone()
+            if row and row[:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            sha1 = filehash(path)
+        except OSError as e:
+            nerror += 1
+            print('error reading {}: {}'.format(path, e), file=sys.stderr)
+            continue
+        if row and row[2] == sha1:
+            con.execute('update files set mtime = ? where path = ?',
+                    (stat.st_mtime_ns, path))
+            continue
+        todo.append((path, stat, sha1))
+    return todo, nerror
+
+def remove(con, path):
+    """Remove a file and its targets and observations from the index.
+    """
+    row = con.execute('select id from files where path = ?',
+            (path,)).fetchone()
+    if row:
+        con.execute('delete from targets where file = ?', row)
+        con.execute('delete from observations where file = ?', row)
+        con.execute('delete from files where id = ?', row)
+
+def insert(con, path, stat, sha1, targets, observations):
+    """Add a file with its TargetRecord and ObservationRecord lists.
+    """
+    import numpy as np
+    remove(con, path)
+    fileid = con.execute('insert into files (path, mtime, size, sha1)'
+            ' values (?, ?, ?, ?)', (path, stat.st_mtime_ns, stat.st_size,
+            sha1)).lastrowid
+    if targets:
+        table = aptx.target_table(targets)
+        ra = table['ra'].value
+        dec = table['dec'].value
+        band = np.floor((dec + 90) / BAND)
+        con.executemany('insert into targets values (?,?,?,?,?,?,?,?,?)',
+                [(fileid, r.number, r.propname, r.archname)
+                + tuple(None if v != v else float(v) for v in vals)
+                + (None if b != b else int(b),) for r, vals, b in zip(targets,
+                zip(ra, dec, table['pmra'].value, table['pmdec'].value),
+                band)])
+    con.executemany('insert into observations values'
+            ' (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+            [(fileid, o.number,
+            o.targetid.split()[0] if o.targetid else None, o.targetid,
+            o.instrument, o.templateid, o.templatename)
+            + (tuple(o.mosaic) if o.mosaic else (None,) * 6)
+            for o in observations])
+
+def index(con, aptxfiles, jobs=1, prune=False):
+    """Add new or changed .aptx files to the index.
+    """
+    paths = list(dict.fromkeys(os.path.abspath(f) for f in aptxfiles))
+    todo, nunread = changed(con, paths)
+    nerror = 0
+    files = {t[0]: t for t in todo}
+    for res in aptx.batch(aptx.records, list(files), jobs=jobs,
+            report=len(files) > 1, server=True):
+        path, stat, sha1 = files[res.aptxfile]
+        if res.error:
+            nerror += 1
+            print('error reading {}: {}'.format(path, res.error),
+                    file=sys.stderr)
+            remove(con, path)
+        else:
+            with aptx.profiler.stage('sqlite insert'):
+                insert(con, path, stat, sha1, *res.result)
+    if prune:
+        for (path,) in con.execute('select path from files').fetchall():
+            if not os.path.exists(path):
+                remove(con, path)
+    con.commit()
+    print('{} files indexed, {} unchanged, {} errors'.format(
+            len(files) - nerror, len(paths) - len(files) - nunread,
+            nerror + nunread), file=sys.stderr)
+    return nerror + nunread
+
+def position(pos):
+    """Return RA and Dec in degrees from a string with RA and Dec in
+    degrees, or in sexagesimal hours and degrees.
+    """
+    words = pos.replace(':', ' ').split()
+    if len(words) == 2:
+        return float(words[0]), float(words[1])
+    ra, dec = aptx.parse_coords([' '.join(words)])
+    if ra[0] != ra[0]:
+        raise ValueError('cannot parse position {}'.format(pos))
+    return ra[0], dec[0]
+
+def unitvec(ra, dec):
+    """Return array of unit vectors for RA and Dec in degrees.
+    """
+    import numpy as np
+    ra, dec = np.radians(ra), np.radians(dec)
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra),
+            np.sin(dec)], axis=-1)
+
+def query(con, pos=None, radius=5.0, instrument=None, template=None):
+    """Return list of (path, obs, target, ra, dec, sep, instrument,
+    template) rows for observations that match. sep is the separation in
+    arcmin from pos, if given. The position search first selects targets
+    in the declination bands within radius, then in the RA range, unless
+    the search reaches a pole, and then checks the exact separation.
+    """
+    import numpy as np
+    where, params = [], []
+    if pos is not None:
+        ra0, dec0 = position(pos)
+        r = radius / 60
+        dmin, dmax = max(dec0 - r, -90), min(dec0 + r, 90)
+        where.append('t.band between ? and ?')
+        params += [int(np.floor((dmin + 90) / BAND)),
+                int(np.floor((dmax + 90) / BAND))]
+        where.append('t.dec between ? and ?')
+        params += [dmin, dmax]
+        if dmin > -90 and dmax < 90:
+            dra = np.degrees(np.arcsin(min(1.0, np.sin(np.radians(r))
+                    / np.cos(np.radians(max(abs(dmin), abs(dmax)))))))
+            lo, hi = ra0 - dra, ra0 + dra
+            if lo < 0 or hi >= 360:
+                where.append('(t.ra >= ? or t.ra <= ?)')
+                params += [lo % 360, hi % 360]
+            else:
+                where.append('t.ra between ? and ?')
+                params += [lo, hi]
+    if instrument is not None:
+        where.append('upper(o.instrument) = upper(?)')
+        params.append(instrument)
+    if template is not None:
+        where.append('(o.templatename = ? or o.templateid = ?)')
+        params += [template, template]
+    sql = ('select f.path, o.number, o.targetid, t.ra, t.dec,'
+            ' o.instrument, o.templatename from observations o'
+            ' join files f on f.id = o.file'
+            ' left join targets t on t.file = o.file'
+            ' and t.number = o.targetnum')
+    if where:
+        sql += ' where ' + ' and '.join(where)
+    rows = con.execute(sql + ' order by f.path, o.file, cast(o.number as'
+            ' integer)', params).fetchall()
+    if pos is None:
+        return [row[:5] + (None,) + row[5:] for row in rows]
+    coords = np.array([row[3:5] for row in rows], dtype=float).reshape(-1, 2)
+    cos = unitvec(*coords.T) @ unitvec(ra0, dec0)
+    sep = np.degrees(np.arccos(np.clip(cos, -1, 1))) * 60
+    return [row[:5] + (s,) + row[5:] for row, s in zip(rows, sep)
+            if s <= radius]
+
+def main():
+    args = arguments()
+    if args.profile:
+        aptx.profiler.enable(args.profile)
+    con = connect(args.db)
+    if args.command == 'index':
+        if index(con, args.aptxfiles, jobs=args.jobs, prune=args.prune):
+            sys.exit(1)
+    else:
+        rows = query(con, pos=args.pos, radius=args.radius,
+                instrument=args.instrument, template=args.template)
+        for path, obs, target, ra, dec, sep, instrument, template in rows:
+            print('{} obs {:>3} {:9.5f} {:9.5f} {} {} {} {}'.format(
+                    os.path.basename(path), obs, ra if ra is not None
+                    else float('nan'), dec if dec is not None
+                    else float('nan'), '' if sep is None
+                    else '{:6.2f}\''.format(sep), instrument, template,
+                    target))
+
+if __name__ == '__main__':
+    main()
@@ -5,26 +5,42 @@ import argparse
 import textwrap
 import os.path
 
-parser = argparse.ArgumentParser(
-    description='Print schema version of .aptx files.',
-    epilog='example: aptx_schemaver.py *.aptx')
-parser.add_argument('aptxfiles', nargs='+', help='aptx file specification')
-args = parser.parse_args()
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Print schema version of .aptx files.',
+        epilog='example: aptx_schemaver.py *.aptx')
+    parser.add_argument('aptxfiles', nargs='+', help='aptx file specification')
+    parser.add_argument('--jobs', type=int, default=1,
+            help='number of files to process in parallel')
+    parser.add_argument('--profile', metavar='FILE',
+            help='write per-stage timing and memory to JSON FILE, or cProfile '
+            'dump if FILE ends with .prof')
+    return parser.parse_args()
 
-dict = {}
-for aptxfile in args.aptxfiles:
-    basename = os.path.basename(aptxfile)
-    rootname = basename.rstrip('.aptx')
-    try:
-        version = aptx.Proposal(aptxfile).schemaversion
-        dict[rootname] = version
-    except:
-        print('error reading schema version for {}'.format(aptx))
+def main():
+    args = arguments()
+    if args.profile:
+        aptx.profiler.enable(args.profile)
 
-if len(dict) > 0:
-    versions = sorted(set(dict.values()))
-    for version in versions:
-        rootnames = [k for k,v in dict.items() if v == version]
-        out = 'schemaVersion=' + version + ': ' + ' '.join(rootnames)
-        for line in textwrap.wrap(out, width=78):
-            print(line)
+    dict = {}
+    for res in aptx.batch(aptx.schemaversion, args.aptxfiles, jobs=args.jobs,
+            report=len(args.aptxfiles) > 1, server=True):
+        basename = os.path.basename(res.aptxfile)
+        rootname = basename.rstrip('.aptx')
+        if res.error:
+            print('error reading schema version for {}'.format(res.aptxfile))
+        else:
+            dict[rootname] = res.result
+
+    if len(dict) > 0:
+        versions = sorted(set(dict.values()))
+        for version in versions:
+            rootnames = [k for k,v in dict.items() if v == version]
+            out = 'schemaVersion=' + version + ': ' + ' '.join(rootnames)
+            for line in textwrap.wrap(out, width=78):
+                print(line)
+
+if __name__ == '__main__':
+    main()
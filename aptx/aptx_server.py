@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import argparse
+import copy
+import functools
+import os
+import socket
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+import aptx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..'))
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Serve summaries, targets, observations, guide star'
+                ' windows of .aptx files and tables of .sql files from a'
+                ' local server that keeps parsed files in memory.'
+                ' aptx_summary.py, aptx_schemaver.py, aptx_gswin.py,'
+                ' aptx_index.py and apt_sql.py use the server when it is'
+                ' running, unless run with --jobs greater than 1. Library'
+                ' callers of aptx.batch ask for it with server=True.',
+        epilog='example: aptx_server.py serve --max 64 & '
+                'aptx_summary.py *.aptx; aptx_server.py stop')
+    parser.add_argument('command', choices=['serve', 'status', 'stop'],
+            help='run server in foreground, print its cache statistics,'
+            ' or stop it')
+    parser.add_argument('--socket', metavar='PATH',
+            help='Unix socket (default $APTX_SERVER, or aptx_server-UID.sock'
+            ' in $XDG_RUNTIME_DIR or $TMPDIR)')
+    parser.add_argument('--max', type=int, default=32,
+            help='maximum number of parsed files kept (default 32)')
+    parser.add_argument('--profile', metavar='FILE',
+            help='write per-stage timing and memory to JSON FILE, or '
+            'cProfile dump if FILE ends with .prof, when the server stops')
+    return parser.parse_args()
+
+class FileCache:
+    """Least recently used cache of parsed files. An entry is dropped when
+    its file's mtime or size changes. Each entry also has a dictionary, to
+    keep results derived from the parsed file. Hit, miss and eviction
+    counts are kept in stats.
+    """
+
+    def __init__(self, maxentries=32):
+        self.maxentries = maxentries
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, path, cls):
+        """Return cls(path) and its dictionary of derived results, parsing
+        the file only if it is not cached or changed.
+        """
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = (cls.__name__, path)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.stats['hits'] += 1
+            self.entries.move_to_end(key)
+            return entry[1:]
+        self.stats['misses'] += 1
+        self.entries.pop(key, None)
+        entry = self.entries[key] = (stamp, cls(path), {})
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+        return entry[1:]
+
+class Handler(socketserver.BaseRequestHandler):
+    """Answer one request: (op, path, name, kwargs) with (result, output,
+    error), like BatchResult.
+    """
+
+    def handle(self):
+        try:
+            op, path, name, kwargs = aptx.recv_msg(self.request)
+        except (OSError, EOFError):
+            return
+        if op == 'stats':
+            reply = (dict(self.server.cache.stats,
+                    entries=len(self.server.cache.entries)), '', None)
+        elif op == 'shutdown':
+            threading.Thread(target=self.server.shutdown).start()
+            reply = (None, '', None)
+        else:
+            with self.server.lock:
+                res = aptx.batchcall(functools.partial(self.server.call, op,
+                        path, kwargs), name)
+            reply = res[1:]
+        try:
+            aptx.send_msg(self.request, reply)
+        except OSError:
+            pass
+        except Exception as e:
+            aptx.send_msg(self.request, (None, reply[1],
+                    '{}: {}'.format(type(e).__name__, e)))
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Server of requests on parsed .aptx and .sql files. Requests are
+    applied one at a time, under a lock, because printed output is
+    captured by redirecting stdout. If threaded is False, requests are
+    handled in the serving thread, so that a cProfile dump covers them.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, maxentries=32, threaded=True):
+        # Create the socket readable by this user only: requests are
+        # unpickled.
+        umask = os.umask(0o177)
+        try:
+            super().__init__(address, Handler)
+        finally:
+            os.umask(umask)
+        self.cache = FileCache(maxentries)
+        self.lock = threading.Lock()
+        self.threaded = threaded
+
+    def process_request(self, request, client_address):
+        if self.threaded:
+            super().process_request(request, client_address)
+        else:
+            socketserver.UnixStreamServer.process_request(self, request,
+                    client_address)
+
+    def call(self, op, path, kwargs, name):
+        """Return result of op on the file at path, which the client
+        calls name.
+        """
+        if op in ('tablenames', 'table'):
+            import apt_sql
+            sql, tables = self.cache.get(path, apt_sql.Sqlfile)
+            if op == 'tablenames':
+                return sql.tablenames
+            tablename = kwargs['tablename']
+            if tablename not in tables:
+                tables[tablename] = sql.table(tablename)
+            return tables[tablename]
+        if op == 'schemaversion':
+            # Reading the root element is cheaper than a cache miss, and
+            # the version alone is not worth a cache entry.
+            return aptx.schemaversion(path)
+        prop, derived = self.cache.get(path, aptx.Proposal)
+        # Shallow copy sharing the parsed XML, to report the file name
+        # the client used.
+        prop = copy.copy(prop)
+        prop.aptxfile = name
+        if op == 'summary':
+            prop.summary()
+        elif op == 'records':
+            return prop.target_records(), prop.observation_records()
+        elif op == 'gswins':
+            key = ('gswins', repr(sorted(kwargs.items())))
+            if key not in derived:
+                derived[key] = aptx.gswins(prop, **kwargs)
+            return derived[key]
+        else:
+            raise ValueError('unknown request {}'.format(op))
+
+def listening(address):
+    """Return True if a server is listening on the socket address.
+    """
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(address)
+        except OSError:
+            return False
+    return True
+
+def main():
+    args = arguments()
+    if args.profile and args.command == 'serve':
+        aptx.profiler.enable(args.profile)
+    if args.socket:
+        os.environ['APTX_SERVER'] = args.socket
+    address = aptx.server_address()
+    if address is None:
+        sys.exit('no server socket: APTX_SERVER is empty')
+    if args.command == 'serve':
+        if listening(address):
+            sys.exit('server already running on {}'.format(address))
+        if os.path.exists(address):
+            os.remove(address)
+        server = Server(address, args.max,
+                threaded=not (args.profile or '').endswith('.prof'))
+        print('serving on {}'.format(address), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(address)
+        return
+    res = aptx.server_request('stats' if args.command == 'status'
+            else 'shutdown', address)
+    if res is None:
+        sys.exit('no server running on {}'.format(address))
+    if args.command == 'status':
+        print('{}: {}'.format(address, ', '.join('{} {}'.format(v, k)
+                for k, v in res.result.items())))
+
+if __name__ == '__main__':
+    main()
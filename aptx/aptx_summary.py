@@ -1,14 +1,38 @@
 #!/usr/bin/env python
 
 import argparse
+import sys
 import aptx
 
-parser = argparse.ArgumentParser(
-    description='Print summary of .aptx file to terminal.',
-    epilog='example: aptx_summary.py 12345.aptx')
-parser.add_argument('aptxfiles', nargs='+', help='filename of .aptx file')
-args = parser.parse_args()
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Print summary of .aptx file to terminal.',
+        epilog='example: aptx_summary.py 12345.aptx')
+    parser.add_argument('aptxfiles', nargs='+', help='filename of .aptx file')
+    parser.add_argument('--jobs', type=int, default=1,
+            help='number of files to process in parallel')
+    parser.add_argument('--profile', metavar='FILE',
+            help='write per-stage timing and memory to JSON FILE, or cProfile '
+            'dump if FILE ends with .prof')
+    return parser.parse_args()
 
-for aptxfile in args.aptxfiles:
-    aptx.Proposal(aptxfile).summary()
-    print('-----')
+def main():
+    args = arguments()
+    if args.profile:
+        aptx.profiler.enable(args.profile)
+    nerror = 0
+    for res in aptx.batch(aptx.summary, args.aptxfiles, jobs=args.jobs,
+            report=len(args.aptxfiles) > 1, server=True):
+        if res.error:
+            nerror += 1
+            print('error reading {}: {}'.format(res.aptxfile, res.error))
+        else:
+            print(res.output, end='')
+        print('-----')
+    if nerror:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'aptx'))
+import aptx
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', 'aptx', 'onc1.aptx')
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time aptx element wrappers on proposals built by'
+                ' replicating the observations and targets in onc1.aptx.',
+        epilog='example: bench_aptx.py -n 10 100 1000')
+    parser.add_argument('-n', type=int, nargs='+', default=[10, 100, 500],
+            help='number of observations in each synthetic proposal')
+    return parser.parse_args()
+
+def synthetic_proposal(aptxfile, nobs, sample=SAMPLE):
+    """Write .aptx file with nobs observations and nobs targets, copied
+    round-robin from those in the sample proposal and renumbered.
+    """
+    prop = aptx.Proposal(sample)
+    for tag, parent in (('Target', 'Targets'),
+            ('Observation', 'ObservationGroup')):
+        elems = aptx.xpath('descendant::apt:' + tag)(prop.root)
+        group = elems[0].getparent()
+        for e in elems:
+            group.remove(e)
+        for i in range(nobs):
+            e = copy.deepcopy(elems[i % len(elems)])
+            aptx.descendant(e, 'Number').text = str(i + 1)
+            group.append(e)
+    xmlfile = os.path.splitext(os.path.basename(aptxfile))[0] + '.xml'
+    with zipfile.ZipFile(aptxfile, 'w', zipfile.ZIP_DEFLATED) as zfile:
+        zfile.writestr('META-INF/MANIFEST.MF', prop.zdata['META-INF/MANIFEST.MF'])
+        zfile.writestr(xmlfile, aptx.etree.tostring(prop.root,
+                doctype=prop.doctype.decode()))
+
+def naive_observation(elem):
+    """Reference implementation: per-object nsmap and ElementPath finds.
+    """
+    ns = elem.nsmap
+    ns['apt'] = ns.pop(None)
+    fields = [elem.find('.//apt:' + tag, ns)
+            for tag in ('Number', 'TargetID', 'Instrument')]
+    template = elem.xpath('.//apt:Template', namespaces=ns)[0]
+    tns = template.nsmap
+    tns['apt'] = tns.pop(None)
+    return fields, template
+
+def naive_target(elem):
+    """Reference implementation: per-object nsmap and ElementPath finds.
+    """
+    ns = elem.nsmap
+    ns['apt'] = ns.pop(None)
+    return [elem.find('.//apt:' + tag, ns) for tag in ('Number',
+            'TargetName', 'TargetID', 'EquatorialCoordinates',
+            'RAProperMotion', 'RAProperMotionUnits', 'DecProperMotion',
+            'DecProperMotionUnits')]
+
+def timeit(func, *args, repeat=3):
+    """Return best wall time of repeat calls to func(*args).
+    """
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+def main():
+    args = arguments()
+    print('{:>6} {:>10} {:>10} {:>8}'.format(
+            'nobs', 'naive (s)', 'new (s)', 'speedup'))
+    for nobs in args.n:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            aptxfile = os.path.join(tmpdir, 'synthetic.aptx')
+            synthetic_proposal(aptxfile, nobs)
+            prop = aptx.Proposal(aptxfile)
+        obselems = list(prop.index('Observation').values())
+        targelems = list(prop.index('Target').values())
+
+        def naive():
+            for e in obselems:
+                naive_observation(e)
+            for e in targelems:
+                naive_target(e)
+
+        def new():
+            for e in obselems:
+                aptx.Observation(e).template()
+            for e in targelems:
+                aptx.Target(e)
+
+        tnaive = timeit(naive)
+        tnew = timeit(new)
+        print('{:6d} {:10.4f} {:10.4f} {:8.2f}'.format(
+                nobs, tnaive, tnew, tnaive / tnew))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'aptx'))
+import aptx
+from astropy.table import Table
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time aptx readers of APT export files on synthetic'
+                ' .pointing and .times files.',
+        epilog='example: bench_exports.py -n 1000 10000 100000')
+    parser.add_argument('-n', type=int, nargs='+', default=[1000, 10000],
+            help='number of pointings (and exposures) in each synthetic file')
+    return parser.parse_args()
+
+def synthetic_pointing(filename, npoint, pervisit=20):
+    """Write synthetic APT .pointing file with npoint pointings, in visits
+    of pervisit pointings. Every third pointing has 21 columns (no ddist).
+    """
+    with open(filename, 'w') as f:
+        f.write('JWST Pointing file (synthetic)\n')
+        for i in range(npoint):
+            if i % pervisit == 0:
+                visit = i // pervisit
+                f.write('** Visit {}:{}\n'.format(visit // 10 + 1, visit % 10 + 1))
+                f.write('Tar Tile Exp Dith Aperture Name Target'
+                        ' RA Dec BaseX BaseY DithX DithY V2 V3 IdlX IdlY'
+                        ' Level Type ExPar DkPar dDist\n')
+            f.write(' 1 1 {} {} NRCALL_FULL 1 NAME-UDF {:.8f} {:.8f}'
+                    ' 0.000 0.000 {:.3f} {:.3f} -0.318 -492.618'
+                    ' {:.3f} {:.3f} SCIENCE EXPOSURE 1 1'.format(
+                    i % pervisit // 4 + 1, i % 4 + 1,
+                    53.1625 + 1e-5 * i, -27.79 - 1e-5 * i,
+                    0.5 * (i % 4), -0.5 * (i % 4), 0.1 * i, -0.1 * i))
+            f.write('\n' if i % 3 == 2 else ' {:.3f}\n'.format(0.1 * (i % 7)))
+
+def naive_pointing(pfile):
+    """Reference implementation: one Table.add_row per pointing.
+    """
+    _pnames = ('obsnum','visnum','targ','tile','expnum','dith',
+            'aperture','targnum','propname','radeg','decdeg','xbase',
+            'ybase','xdith','ydith','v2','v3','xidl',
+            'yidl','level','type','expar','dkpar','ddist')
+    _pdtype = ('i4','i4','i4','i4','i4','i4',
+            'S99','i4','S99','f8','f8','f4',
+            'f4','f4','f4','f4','f4','f4',
+            'f4','S99','S99','i4','i4','f4')
+    point = Table(names=_pnames, dtype=_pdtype)
+    with open(pfile, 'r') as file:
+        for line in file:
+            words = line.split()
+            if line.startswith('** Visit '):
+                obsnum,visnum = line[9:].strip().split(':')
+            elif len(words)==21 and words[0].isdigit():
+                point.add_row([obsnum,visnum]+line.split()+[None])
+            elif len(words)==22 and words[0].isdigit():
+                point.add_row([obsnum,visnum]+line.split())
+    return point
+
+def synthetic_times(filename, nexpo, perobs=40, pervisit=4):
+    """Write synthetic APT .times file with nexpo exposures, in
+    observations of perobs exposures and visits of pervisit exposures.
+    """
+    with open(filename, 'w') as f:
+        f.write('JWST Times file (synthetic)\n')
+        for i in range(nexpo):
+            if i % perobs == 0:
+                f.write('* Observation {}\n'.format(i // perobs + 1))
+                f.write(' {} {}\n'.format(3600 + i, 4000 + i))
+            if i % pervisit == 0:
+                f.write(' {} ( {:.3f}) 1200 300 30 600 200 100 2430\n'.format(
+                        i % perobs // pervisit + 1, 0.1 * (i % 5)))
+            f.write(' {} FULL DEEP8 10.737 {} 8 12 1 1030.8 4 1 1 4'
+                    ' 4123.2 4300 4400\n'.format(i % perobs + 1, i % 10 + 1))
+
+def naive_times(tfile):
+    """Reference implementation: one Table.add_row per line.
+    """
+    obs = Table(names=aptx._onames, dtype=aptx._odtype)
+    visit = Table(names=aptx._vnames, dtype=aptx._vdtype)
+    expo = Table(names=aptx._enames, dtype=aptx._edtype)
+    with open(tfile, 'r') as file:
+        for line in file:
+            words = line.split()
+            if line.startswith('* Observation '):
+                obsnum = line.split()[-1]
+            elif len(words)==2 and words[0].isdigit():
+                obs.add_row([obsnum]+line.split())
+            elif len(words)==16 and words[0].isdigit():
+                expo.add_row([obsnum]+line.split())
+            elif len(words)>9 and words[0].isdigit():
+                line2 = line.replace('(','').replace(')','')
+                visit.add_row([obsnum]+line2.split())
+    return obs,visit,expo
+
+def compare(old, new):
+    """Check that two tables have the same columns, types and values.
+    """
+    assert old.colnames == new.colnames and old.dtype == new.dtype
+    for name in old.colnames:
+        a, b = old[name], new[name]
+        if a.dtype.kind == 'f':
+            assert ((a == b) | (a != a) & (b != b)).all(), name
+        else:
+            assert (a == b).all(), name
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+def main():
+    args = arguments()
+    print('{:>8} {:>24} {:>24}'.format('', 'pointing (s)', 'times (s)'))
+    print('{:>8}'.format('n') + ' {:>8} {:>8} {:>7}'.format(
+            'naive', 'new', 'speedup') * 2)
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pfile = os.path.join(tmpdir, 'synthetic.pointing')
+            synthetic_pointing(pfile, n)
+            old, tpold = timed(naive_pointing, pfile)
+            new, tpnew = timed(aptx.pointing, pfile)
+            compare(old, new)
+            tfile = os.path.join(tmpdir, 'synthetic.times')
+            synthetic_times(tfile, n)
+            old, ttold = timed(naive_times, tfile)
+            new, ttnew = timed(aptx.times, tfile)
+            for a, b in zip(old, new):
+                compare(a, b)
+        print(('{:8d}' + ' {:8.3f} {:8.3f} {:7.1f}' * 2).format(n,
+                tpold, tpnew, tpold / tpnew, ttold, ttnew, ttold / ttnew))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'aptx'))
+import aptx
+import numpy as np
+from astropy.table import Table
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time aptx.WindowIndex queries on synthetic guide star'
+                ' windows, against a linear scan.',
+        epilog='example: bench_gswin.py -n 100000 1000000 -q 1000')
+    parser.add_argument('-n', type=int, nargs='+', default=[100000, 1000000],
+            help='number of windows')
+    parser.add_argument('-q', type=int, default=200,
+            help='number of queries of each kind')
+    return parser.parse_args()
+
+def synthetic_windows(nwin, pervisit=100, seed=1):
+    """Return table of nwin synthetic windows, in visits of pervisit
+    contiguous windows over one year, with durations spanning minutes to
+    weeks and V3PA ranges that sometimes wrap through 360.
+    """
+    rng = np.random.default_rng(seed)
+    nvisit = max(nwin // pervisit, 1)
+    visit = np.arange(nwin) // pervisit
+    dur = np.exp(rng.uniform(np.log(600), np.log(2e6), nwin))
+    start = rng.uniform(1.55e9, 1.58e9, nvisit)[np.minimum(visit, nvisit-1)]
+    t1 = start + np.cumsum(dur) - dur
+    for v in range(0, nwin, pervisit):
+        t1[v:v+pervisit] -= t1[v] - start[v // pervisit]
+    pamin = rng.uniform(0, 360, nwin)
+    return Table([visit // 1000 + 1, visit % 1000 + 1, t1.round(),
+            (t1 + dur).round(), pamin.round(3),
+            ((pamin + rng.uniform(1, 60, nwin)) % 360).round(3),
+            rng.uniform(0.1, 1, nwin)], names=('obs', 'visit', 'tstart',
+            'tend', 'v3pamin', 'v3pamax', 'prob'))
+
+def synthetic_pcf(nwin, seed=1):
+    """Return synthetic visit planner scheduling PCF string with nwin
+    windows, like the StSchedulingPCF attribute: times in unix ms, each
+    window preceded by a probability and, if it is not 0, a V3PA range.
+    """
+    rng = np.random.default_rng(seed)
+    times = 1551398400000 + np.cumsum(rng.integers(600, 2000000, nwin + 1)
+            ) * 1000
+    prob = np.where(rng.random(nwin) < 0.3, 0.0, rng.uniform(0.1, 1, nwin)
+            .round(6))
+    pamin = rng.uniform(0, 360, nwin).round(3)
+    pamax = ((pamin + rng.uniform(1, 60, nwin)) % 360).round(3)
+    words = [str(times[0])]
+    for t, p, a1, a2 in zip(times[1:], prob, pamin, pamax):
+        words.append(repr(float(p)))
+        if p > 0:
+            words.append('{}:{}'.format(a1, a2))
+        words.append(str(t))
+    return ' '.join(words)
+
+def scan_at(w, t, pa=None):
+    """Reference implementation: linear scan for windows containing t.
+    """
+    t1, t2 = np.asarray(w['tstart']), np.asarray(w['tend'])
+    sel = (t1 <= t) & (t2 >= t)
+    if pa is not None:
+        sel &= aptx.arcs_overlap(np.asarray(w['v3pamin']),
+                np.asarray(w['v3pamax']), *pa)
+    return np.flatnonzero(sel)
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+def main():
+    args = arguments()
+    print('{:>9} {:>8} {:>11} {:>11} {:>8} {:>11}'.format('n', 'build (s)',
+            'scan (ms)', 'index (ms)', 'speedup', 'common (ms)'))
+    rng = np.random.default_rng(2)
+    for n in args.n:
+        w = synthetic_windows(n)
+        index, tbuild = timed(aptx.WindowIndex, w)
+        times = rng.uniform(1.55e9, 1.6e9, args.q)
+        pas = rng.uniform(0, 360, (args.q, 2))
+        tscan = tindex = 0
+        for t, pa in zip(times, pas):
+            ref, dt = timed(scan_at, w, t, pa)
+            tscan += dt
+            idx, dt = timed(index.search, t, t, pa)
+            tindex += dt
+            assert (np.sort(index.order[idx]) == ref).all()
+        nvisit = len(np.unique(index.visit))
+        tcommon = 0
+        for i in range(args.q):
+            vis = rng.integers(0, nvisit, 3)
+            vis = [(v // 1000 + 1, v % 1000 + 1) for v in vis]
+            res, dt = timed(index.common, vis)
+            tcommon += dt
+        print('{:9d} {:8.2f} {:11.3f} {:11.3f} {:8.1f} {:11.3f}'.format(n,
+                tbuild, 1e3 * tscan / args.q, 1e3 * tindex / args.q,
+                tscan / tindex, 1e3 * tcommon / args.q))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import apt_sql
+# apt_sql imports astropy.table on first use. Import it here, so that the
+# timings do not include it.
+import astropy.table
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time apt_sql.Sqlfile on synthetic APT .sql exports.',
+        epilog='example: bench_sql.py -n 100000 1000000 10000000')
+    parser.add_argument('-n', type=float, nargs='+', default=[1e5, 1e6],
+            help='number of insert statements in each synthetic export')
+    parser.add_argument('-ntables', type=int, default=10,
+            help='number of tables in each synthetic export')
+    return parser.parse_args()
+
+def synthetic_sql(filename, nrows, ntables=10, ncols=24):
+    """Write a synthetic APT .sql export with nrows insert statements
+    spread evenly over ntables tables. Each table has ncols columns:
+    integers, floats and quoted strings in rotation.
+    """
+    keys = ['program', 'observation', 'visit', 'apt_label']
+    keys += ['col{:02d}'.format(i) for i in range(ncols - len(keys))]
+    keystr = '( ' + ', '.join(keys) + ' )'
+    fmt = ['{0}', "'{0:03d}'", "'EXPO{0}'", '{1:.3f}'] * ncols
+    fmt = 'values ( 1234, ' + ', '.join(fmt[:ncols - 1]) + ' )\n'
+    with open(filename, 'w') as f:
+        f.write('insert into #AOK values ( 1 )\n')
+        for i in range(nrows):
+            f.write('insert into table{:02d} {} '.format(i % ntables, keystr))
+            f.write(fmt.format(i, 0.5 * i))
+
+def naive_keyvals(line, prefix):
+    """Reference implementation: split on 'values' and bare commas.
+    """
+    keystr, valstr = line[len(prefix):].strip().split('values')
+    keys = [k.strip() for k in keystr[2:-2].split(',')]
+    vals = [v.strip() for v in valstr[2:-2].split(',')]
+    return keys, vals
+
+def scan_rows(sql, tablename):
+    """Reference implementation: scan every line for each table.
+    """
+    prefix = 'insert into ' + tablename + ' '
+    rows = list()
+    for line in sql:
+        if line[:len(prefix)] == prefix:
+            keys, vals = naive_keyvals(line, prefix)
+            rows.append(dict(zip(keys, vals)))
+    return rows
+
+def scan_tablenames(sql):
+    """Reference implementation: scan every line for table names.
+    """
+    prefix = 'insert into '
+    names = set()
+    for line in sql:
+        if line[:len(prefix)] == prefix:
+            names.add(line[len(prefix):line.find('(')].strip())
+    names.discard('#AOK values')
+    return sorted(names)
+
+def naive_table(rows):
+    """Reference implementation: per-element type conversion.
+    """
+    keys = sorted(set().union(*rows))
+    cols = dict()
+    for key in keys:
+        col = [row.get(key, '') for row in rows]
+        try:
+            col = [int(x) for x in col]
+        except ValueError:
+            try:
+                col = [float(x) for x in col]
+            except ValueError:
+                col = [x[1:-1] if x.startswith("'") and x.endswith("'")
+                        else x for x in col]
+        cols[key] = col
+    return cols
+
+def main():
+    args = arguments()
+    print('{:>9} {:>25} {:>25} {:>25}'.format('',
+            'load all tables (s)', 'tokenize one table (s)',
+            'build all tables (s)'))
+    print('{:>9}'.format('nrows') + ' {:>8} {:>8} {:>7}'.format(
+            'naive', 'new', 'speedup') * 3)
+    for n in args.n:
+        nrows = int(n)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sqlfile = os.path.join(tmpdir, 'synthetic.sql')
+            synthetic_sql(sqlfile, nrows, args.ntables)
+
+            t0 = time.perf_counter()
+            with open(sqlfile) as f:
+                sql = [line.rstrip() for line in f]
+            rows = [scan_rows(sql, name) for name in scan_tablenames(sql)]
+            tscan = time.perf_counter() - t0
+            for table in rows:
+                naive_table(table)
+            tnaivetab = time.perf_counter() - t0
+            del rows
+
+            # Tokenize one table into the form the table build uses: a
+            # dictionary per row before, columns now.
+            prefix = 'insert into table00 '
+            lines = [line for line in sql if line.startswith(prefix)]
+            del sql
+            t0 = time.perf_counter()
+            scan_rows(lines, 'table00')
+            tnaive = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            for keys, cols in apt_sql.tokenize_columns(lines, prefix):
+                pass
+            ttoken = time.perf_counter() - t0
+            del lines
+
+            t0 = time.perf_counter()
+            sqlf = apt_sql.Sqlfile(sqlfile)
+            for name in sqlf.tablenames:
+                sqlf.rows_from_sql(name)
+            tindex = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            sqlf = apt_sql.Sqlfile(sqlfile)
+            for name in sqlf.tablenames:
+                sqlf.table(name)
+            ttable = time.perf_counter() - t0
+            del sqlf
+        print(('{:9d}' + ' {:8.3f} {:8.3f} {:7.2f}' * 3).format(nrows,
+                tscan, tindex, tscan / tindex, tnaive, ttoken, tnaive / ttoken,
+                tnaivetab, ttable, tnaivetab / ttable))
+
+if __name__ == '__main__':
+    main()
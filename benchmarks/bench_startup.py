@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench_sql
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+APTX = os.path.join(ROOT, 'aptx')
+
+# Modules that must not be imported on the startup paths checked here.
+HEAVY = ('astropy', 'numpy')
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Check that the scripts start quickly: --help and'
+                ' listing schema versions or sql table names must not'
+                ' import astropy or numpy, and must finish within a time'
+                ' limit. Exit with status 1 otherwise.',
+        epilog='example: bench_startup.py --max 0.5')
+    parser.add_argument('--max', type=float, default=0.5,
+            help='maximum wall time in seconds per command (default 0.5)')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='number of runs per command; the best is kept')
+    return parser.parse_args()
+
+def importtime(cmd):
+    """Run python -X importtime with cmd. Return wall time, and dictionary
+    of cumulative import time in seconds of each top-level module.
+    """
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + cmd,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError('{} failed:\n{}'.format(' '.join(cmd),
+                proc.stderr[-2000:]))
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self, cumulative, name = line[12:].split('|')
+        modules[name.strip()] = int(cumulative) / 1e6
+    return wall, modules
+
+def main():
+    args = arguments()
+    aptxfiles = [os.path.join(APTX, f) for f in sorted(os.listdir(APTX))
+            if f.endswith('.aptx')]
+    nfail = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sqlfile = os.path.join(tmpdir, 'synthetic.sql')
+        bench_sql.synthetic_sql(sqlfile, 1000)
+        commands = [
+            [os.path.join(APTX, 'aptx_summary.py'), '--help'],
+            [os.path.join(APTX, 'aptx_schemaver.py'), '--help'],
+            [os.path.join(APTX, 'aptx_schemaver.py')] + aptxfiles,
+            [os.path.join(APTX, 'aptx_gswin.py'), '--help'],
+            [os.path.join(APTX, 'aptx_index.py'), '--help'],
+            [os.path.join(ROOT, 'apt_sql.py'), '--help'],
+            [os.path.join(ROOT, 'apt_sql.py'), sqlfile],
+        ]
+        print('{:>8} {:>10}  {}'.format('wall (s)', 'import (s)', 'command'))
+        for cmd in commands:
+            runs = [importtime(cmd) for i in range(args.repeat)]
+            wall, modules = min(runs, key=lambda run: run[0])
+            heavy = sorted(name for name in modules
+                    if name.split('.')[0] in HEAVY)
+            name = ' '.join([os.path.basename(cmd[0])] + [os.path.basename(a)
+                    for a in cmd[1:3]] + (['...'] if len(cmd) > 3 else []))
+            print('{:8.3f} {:10.3f}  {}'.format(wall, sum(modules.values()),
+                    name))
+            if heavy:
+                nfail += 1
+                print('    imports ' + ', '.join(heavy))
+            if wall > args.max:
+                nfail += 1
+                print('    slower than {} s'.format(args.max))
+    if nfail:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
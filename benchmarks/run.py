@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_aptx
+import bench_exports
+import bench_gswin
+import bench_sql
+import aptx
+import apt_sql
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'baseline.json')
+
+def arguments():
+    """Parse and return command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time aptx and apt_sql on synthetic APT files of'
+                ' several sizes. Compare with a saved baseline and fail'
+                ' if any case is slower by more than the tolerance.',
+        epilog='example: run.py --save; (change code); run.py')
+    parser.add_argument('cases', nargs='*',
+            help='names of cases to run (default: all)')
+    parser.add_argument('--baseline', default=BASELINE,
+            help='baseline JSON file (default: benchmarks/baseline.json)')
+    parser.add_argument('--save', action='store_true',
+            help='save results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+            help='allowed fractional slowdown (default 0.5)')
+    parser.add_argument('--repeat', type=int, default=5,
+            help='number of timings per case; the best is kept')
+    parser.add_argument('--quick', action='store_true',
+            help='run only the smallest size of each case')
+    return parser.parse_args()
+
+def proposal_load(tmpdir, n):
+    aptxfile = os.path.join(tmpdir, 'synthetic.aptx')
+    bench_aptx.synthetic_proposal(aptxfile, n)
+    return lambda: aptx.Proposal(aptxfile)
+
+def proposal_summary(tmpdir, n):
+    aptxfile = os.path.join(tmpdir, 'synthetic.aptx')
+    bench_aptx.synthetic_proposal(aptxfile, n)
+
+    def run():
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            aptx.Proposal(aptxfile).summary()
+    return run
+
+def proposal_write(tmpdir, n):
+    aptxfile = os.path.join(tmpdir, 'synthetic.aptx')
+    bench_aptx.synthetic_proposal(aptxfile, n)
+    prop = aptx.Proposal(aptxfile)
+    target = prop.targets()[0]
+    target.update(propname='EDITED')
+    prop.update(target=target)
+    return lambda: prop.write(os.path.join(tmpdir, 'edited.aptx'))
+
+def sql_table(tmpdir, n):
+    sqlfile = os.path.join(tmpdir, 'synthetic.sql')
+    bench_sql.synthetic_sql(sqlfile, n, ntables=1)
+    return lambda: apt_sql.Sqlfile(sqlfile).table('table00')
+
+def pointing(tmpdir, n):
+    pfile = os.path.join(tmpdir, 'synthetic.pointing')
+    bench_exports.synthetic_pointing(pfile, n)
+    return lambda: aptx.pointing(pfile)
+
+def times(tmpdir, n):
+    tfile = os.path.join(tmpdir, 'synthetic.times')
+    bench_exports.synthetic_times(tfile, n)
+    return lambda: aptx.times(tfile)
+
+def pcf_windows(tmpdir, n):
+    pcf = bench_gswin.synthetic_pcf(n)
+    return lambda: aptx.pcf_windows(pcf)
+
+def gswins(tmpdir, n):
+    aptxfile = os.path.join(tmpdir, 'synthetic.aptx')
+    bench_aptx.synthetic_proposal(aptxfile, n)
+    prop = aptx.Proposal(aptxfile)
+    return lambda: aptx.gswins(prop, tform='isot')
+
+# Benchmark cases: name, setup function and sizes. Setup writes synthetic
+# input files in a temporary directory and returns the function to time.
+CASES = [
+    ('proposal_load', proposal_load, [10, 100]),
+    ('proposal_summary', proposal_summary, [10, 100]),
+    ('proposal_write', proposal_write, [10, 100]),
+    ('sql_table', sql_table, [10000, 100000]),
+    ('pointing', pointing, [10000, 100000]),
+    ('times', times, [10000, 100000]),
+    ('pcf_windows', pcf_windows, [10000, 100000]),
+    ('gswins', gswins, [2, 8]),
+]
+
+def timeit(func, repeat=5):
+    """Return best wall time of repeat calls to func(), after one untimed
+    call to warm up caches and lazy imports.
+    """
+    func()
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+def main():
+    args = arguments()
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    results = {}
+    nslow = 0
+    print('{:<18} {:>8} {:>10} {:>10} {:>7}'.format('case', 'size',
+            'time (s)', 'base (s)', 'ratio'))
+    for name, setup, sizes in CASES:
+        if args.cases and name not in args.cases:
+            continue
+        for size in sizes[:1] if args.quick else sizes:
+            base = baseline.get(name, {}).get(str(size))
+            with tempfile.TemporaryDirectory() as tmpdir:
+                func = setup(tmpdir, size)
+                dt = timeit(func, args.repeat)
+                # Time a case that looks slower once more, to rule out noise.
+                if base is not None and dt > base * (1 + args.tolerance):
+                    dt = min(dt, timeit(func, args.repeat))
+            results.setdefault(name, {})[str(size)] = dt
+            flag = ''
+            if base is not None and dt > base * (1 + args.tolerance):
+                nslow += 1
+                flag = ' SLOWER'
+            print('{:<18} {:>8} {:>10.4f} {:>10} {:>7}{}'.format(name, size,
+                    dt, '' if base is None else '{:.4f}'.format(base),
+                    '' if base is None else '{:.2f}'.format(dt / base),
+                    flag))
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                    'machine': platform.platform(), 'results': results},
+                    f, indent=1)
+        print('saved baseline to {}'.format(args.baseline))
+    elif not baseline:
+        print('no baseline in {}; run with --save to make one'.format(
+                args.baseline))
+    if nslow:
+        print('{} cases slower than baseline by more than {:.0%}'.format(
+                nslow, args.tolerance))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import aptx
+from conftest import ROOT
+
+np = pytest.importorskip('numpy')
+
+def windows(pcf):
+    return [a.tolist() for a in aptx.pcf_windows(pcf)]
+
+def test_pcf_windows():
+    assert windows('1000 1.0 238.5:278.3 2000 0.0 10:20 3000'
+            ' 0.5 1:2 4000') == [[1000, 3000], [2000, 4000], [238.5, 1.0],
+            [278.3, 2.0], [1.0, 0.5]]
+
+@pytest.mark.parametrize('pcf', ['', '1000', '1000 0.0 2000',
+        '1000 2000 3000'])
+def test_pcf_windows_none(pcf):
+    assert windows(pcf) == [[]] * 5
+
+def test_pcf_windows_no_angle():
+    assert windows('1000 1.0 2000') == [[1000], [2000], [0.0], [0.0], [1.0]]
+
+def test_pcf_windows_off_normal():
+    # off-normal ranges have three fields; the first two are the range.
+    assert windows('1000 0.5 0.715346:346.53:359.99 2000') == [[1000],
+            [2000], [0.715346], [346.53], [0.5]]
+
+@pytest.mark.parametrize('type', ['guide-star', 'abs-con', 'abs-total',
+        'rel-total', 'roll-total', 'off-normal'])
+def test_gswins_types(type):
+    pytest.importorskip('lxml')
+    pytest.importorskip('astropy')
+    table = aptx.gswins(os.path.join(ROOT, 'aptx', 'udf2.aptx'), type=type)
+    assert len(table) > 0
+    assert (table['tstart'] < table['tend']).all()
+    assert (table['prob'] > 0).all()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import time
+
+import pytest
+
+import aptx
+from conftest import ROOT
+
+pytest.importorskip('astropy')
+
+FAKEAPT = os.path.join(ROOT, 'tests', 'fakeapt')
+APTXFILE = os.path.join(ROOT, 'aptx', 'udf1.aptx')
+
+@pytest.fixture
+def aptdir(monkeypatch):
+    monkeypatch.setenv('APTDIR', FAKEAPT)
+
+def proposals(tmp_path, *names):
+    """Return names of copies of udf1.aptx in tmp_path.
+    """
+    files = []
+    for name in names:
+        files.append(str(tmp_path / (name + '.aptx')))
+        shutil.copyfile(APTXFILE, files[-1])
+    return files
+
+def test_success(aptdir, tmp_path):
+    lines = []
+    res, = aptx.run_batch(proposals(tmp_path, 'good'),
+            log=lambda aptxfile, line: lines.append(line))
+    assert res.error is None
+    assert (res.returncode, res.attempts) == (0, 1)
+    assert b'exporting' in res.output and lines[-1] == b'done\n'
+    assert len(res.pointing) == 2
+    assert list(res.pointing['dith']) == [1, 2]
+    obs, visit, expo = res.times
+    assert (len(obs), len(visit), len(expo)) == (1, 1, 2)
+
+def test_no_parse(aptdir, tmp_path):
+    res, = aptx.run_batch(proposals(tmp_path, 'good'), parse=False)
+    assert res.error is None and res.pointing is None and res.times is None
+    assert os.path.exists(str(tmp_path / 'good.pointing'))
+
+def test_failure_retried(aptdir, tmp_path):
+    fail, flaky = aptx.run_batch(proposals(tmp_path, 'fail', 'flaky'),
+            retries=2)
+    assert (fail.returncode, fail.attempts) == (3, 3)
+    assert fail.error == 'APT exit status 3'
+    assert fail.pointing is None
+    assert (flaky.returncode, flaky.attempts, flaky.error) == (0, 2, None)
+    assert len(flaky.pointing) == 2
+
+def test_timeout_kills(aptdir, tmp_path):
+    t0 = time.perf_counter()
+    hang, good = aptx.run_batch(proposals(tmp_path, 'hang', 'good'),
+            timeout=1, retries=1)
+    # The launcher's child keeps the pipe open, so this only returns
+    # quickly if the whole process group was killed.
+    assert time.perf_counter() - t0 < 20
+    assert hang.returncode is None and hang.attempts == 2
+    assert hang.error == 'APT timed out after 1 s'
+    assert good.error is None
+
+def test_bad_inputs(aptdir, tmp_path):
+    notzip = str(tmp_path / 'notzip.aptx')
+    with open(notzip, 'w') as f:
+        f.write('not a zip file')
+    cache = aptx.ExportCache(str(tmp_path / 'cache'), version='fake')
+    bad, good = aptx.run_batch([notzip] + proposals(tmp_path, 'good'),
+            cache=cache)
+    assert bad.error.startswith('BadZipFile')
+    assert good.error is None and len(good.pointing) == 2
+
+def test_missing_apt(monkeypatch, tmp_path):
+    monkeypatch.setenv('APTDIR', str(tmp_path / 'noapt'))
+    res, = aptx.run_batch(proposals(tmp_path, 'good'))
+    assert res.error.startswith('FileNotFoundError')
+
+def test_parse_error(aptdir, tmp_path):
+    res, = aptx.run_batch(proposals(tmp_path, 'noexport'))
+    assert res.returncode == 0 and res.pointing is None
+    assert res.error.startswith('error parsing exports')
+
+def test_cache(aptdir, tmp_path):
+    files = proposals(tmp_path, 'good', 'copy')
+    cache = aptx.ExportCache(str(tmp_path / 'cache'), version='fake')
+    first = aptx.run_batch(files, cache=cache)
+    assert [res.error for res in first] == [None, None]
+    assert len(cache.entries()) == 1
+    for suffix in ('.pointing', '.times'):
+        os.remove(str(tmp_path / ('good' + suffix)))
+    second = aptx.run_batch(files[:1], cache=cache)
+    assert cache.stats['hits'] == 1
+    # Both copies have the same key, so either run's output was kept.
+    assert second[0].output in [res.output for res in first]
+    assert len(second[0].pointing) == 2
+    assert os.path.exists(str(tmp_path / 'good.pointing'))
+
+def test_cache_shared_prefix(aptdir, tmp_path):
+    # p.b.aptx and its exports start with 'p.', but are not exports of
+    # p.aptx.
+    files = proposals(tmp_path, 'p', 'p.b')
+    cache = aptx.ExportCache(str(tmp_path / 'cache'), version='fake')
+    assert aptx.run_batch(files[1:])[0].error is None
+    assert aptx.run_batch(files[:1], cache=cache)[0].error is None
+    entry = cache.entries()[0][2]
+    assert sorted(os.listdir(os.path.join(entry, 'files'))) \
+            == ['.pointing', '.times']
+    with open(files[1], 'ab') as f:
+        f.write(b'edited')
+    with open(files[1], 'rb') as f:
+        edited = f.read()
+    res, = aptx.run_batch(files[:1], cache=cache)
+    assert res.error is None and cache.stats['hits'] == 1
+    with open(files[1], 'rb') as f:
+        assert f.read() == edited
+
+def test_run_cache(aptdir, tmp_path, capsys):
+    aptxfile, = proposals(tmp_path, 'good')
+    cache = aptx.ExportCache(str(tmp_path / 'cache'), version='fake')
+    assert aptx.run(aptxfile, cache=cache) == 0
+    assert cache.stats == {'hits': 0, 'misses': 1, 'evictions': 0}
+    output = capsys.readouterr().out
+    os.remove(str(tmp_path / 'good.pointing'))
+    assert aptx.run(aptxfile, cache=cache) == 0
+    assert cache.stats['hits'] == 1
+    assert capsys.readouterr().out == output
+    assert os.path.exists(str(tmp_path / 'good.pointing'))
+    res, = aptx.run_batch([aptxfile], cache=cache)
+    assert res.error is None and len(res.pointing) == 2
@@ -0,0 +1,125 @@
+import random
+
+import pytest
+
+import apt_sql
+
+PREFIX = 'insert into exposures '
+
+def naive_keyvals(line, prefix):
+    """Reference parser from before the tokenizer: split on 'values' and
+    bare commas. Correct for statements without quoted literals.
+    """
+    keystr, valstr = line[len(prefix):].strip().split('values')
+    keys = [k.strip() for k in keystr[2:-2].split(',')]
+    vals = [v.strip() for v in valstr[2:-2].split(',')]
+    return keys, [None if v == 'NULL' else v for v in vals]
+
+def random_statement(rng, keys=None):
+    """Return random quote-free insert statement with random spacing.
+    """
+    if keys is None:
+        keys = ['key{}'.format(i) for i in rng.sample(range(100),
+                rng.randint(1, 30))]
+    vals = [rng.choice([str(rng.randint(-10**9, 10**9)),
+            repr(rng.uniform(-1e6, 1e6)), 'NULL', 'text', '1e-5'])
+            for k in keys]
+    sep = rng.choice([', ', ',', ',  ', ' , '])
+    pad = rng.choice([' ', '  '])
+    return '{}({}{}{}) values ({}{}{})'.format(PREFIX, pad, sep.join(keys),
+            pad, pad, sep.join(vals), pad)
+
+def random_statements(rng, n):
+    """Return n random quote-free statements, in runs with the same keys
+    and spacing, as APT writes them.
+    """
+    lines = []
+    while len(lines) < n:
+        line = random_statement(rng)
+        keys, vals = naive_keyvals(line, PREFIX)
+        lines.append(line)
+        for i in range(rng.choice([0, 1, 10, 100])):
+            lines.append(line.replace(', '.join(v or 'NULL' for v in vals),
+                    ', '.join(rng.choice(['1', '2.5', 'NULL', 'x'])
+                    for v in vals)))
+    return lines[:n]
+
+def columns_to_rows(blocks):
+    """Return list of (keys, values) per statement from the output of
+    tokenize_columns.
+    """
+    return [(keys, list(vals)) for keys, cols in blocks
+            for vals in zip(*cols)]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_tokenize_quote_free(seed):
+    rng = random.Random(seed)
+    lines = [random_statement(rng) for i in range(2000)]
+    for line, (keys, vals) in zip(lines, apt_sql.tokenize(lines, PREFIX)):
+        assert (list(keys), vals) == naive_keyvals(line, PREFIX), line
+
+@pytest.mark.parametrize('seed', range(5))
+def test_tokenize_columns_quote_free(seed):
+    rng = random.Random(seed)
+    lines = random_statements(rng, 3000)
+    rows = columns_to_rows(apt_sql.tokenize_columns(lines, PREFIX,
+            chunksize=rng.choice([7, 1000, 4096])))
+    assert len(rows) == len(lines)
+    for line, (keys, vals) in zip(lines, rows):
+        assert (list(keys), vals) == naive_keyvals(line, PREFIX), line
+
+QUOTED = [
+    "insert into exposures ( a, b, c ) values ( 1, 'x, y', NULL );",
+    "insert into exposures ( a, b, c ) values ( 2, 'it''s, values', 3 );",
+    "insert into exposures ( a, b, c ) values ( 3, 'x\\'y', 'z' );",
+    "insert into exposures ( a, b, c ) values ( 4, 'plain', '' );",
+    "insert into exposures ( a, b ) values ( 5, '(x)' )",
+    "insert into exposures ( a, b, c ) values ( 6, 'p' )",
+]
+
+def test_tokenize_quoted():
+    assert [vals for keys, vals in apt_sql.tokenize(QUOTED, PREFIX)] == [
+        ['1', "'x, y'", None], ['2', "'it''s, values'", '3'],
+        ['3', "'x\\'y'", "'z'"], ['4', "'plain'", "''"], ['5', "'(x)'"],
+        ['6', "'p'"]]
+
+def test_tokenize_columns_quoted():
+    # Statements with quoted literals fall back to tokenize. Missing
+    # values at the end become None.
+    blocks = list(apt_sql.tokenize_columns(QUOTED, PREFIX))
+    assert [keys for keys, cols in blocks] == [('a', 'b', 'c'), ('a', 'b'),
+            ('a', 'b', 'c')]
+    rows = columns_to_rows(blocks)
+    expect = [vals for keys, vals in apt_sql.tokenize(QUOTED, PREFIX)]
+    expect[-1] += [None]
+    assert [vals for keys, vals in rows] == expect
+
+def test_table(tmp_path):
+    pytest.importorskip('astropy')
+    sqlfile = str(tmp_path / 'test.sql')
+    with open(sqlfile, 'w') as f:
+        f.write('insert into #AOK values ( 1 )\n')
+        f.write('\n'.join(QUOTED[:4]) + '\n')
+        f.write('insert into visits ( program, visit ) values'
+                " ( 1234, '001' );\n")
+    sql = apt_sql.Sqlfile(sqlfile)
+    assert sql.tablenames == ['exposures', 'visits']
+    table = sql.table('exposures')
+    assert list(table['a']) == [1, 2, 3, 4]
+    assert list(table['b']) == ['x, y', "it's, values", "x'y", 'plain']
+    assert list(table['c'].mask) == [True, False, False, False]
+    assert list(sql.table('visits')['visit']) == ['001']
+
+def test_table_int_overflow(tmp_path):
+    pytest.importorskip('astropy')
+    sqlfile = str(tmp_path / 'test.sql')
+    with open(sqlfile, 'w') as f:
+        f.write('insert into big ( a, b ) values ( 1, 1.5 );\n')
+        f.write('insert into big ( a, b ) values'
+                ' ( 99999999999999999999999, 2 );\n')
+        f.write('insert into big ( b ) values ( 3 );\n')
+    table = apt_sql.Sqlfile(sqlfile).table('big')
+    assert table['a'].dtype.kind == 'U'
+    assert list(table['a'][:2]) == ['1', '99999999999999999999999']
+    assert list(table['a'].mask) == [False, False, True]
+    assert table['b'].dtype == 'f8'
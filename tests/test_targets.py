@@ -0,0 +1,40 @@
+import pytest
+
+import aptx
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('astropy')
+
+def record(coord, pmra, pmrau, pmdec, pmdecu):
+    return aptx.TargetRecord('test.aptx', '1', 'T', 'T', coord, pmra, pmrau,
+            pmdec, pmdecu)
+
+def test_pmfactor():
+    assert aptx.pmfactor('sec/yr') == 1e3
+    assert aptx.pmfactor('sec/yr', ra=True) == 15e3
+    assert aptx.pmfactor('arcsec/year', ra=True) == 1e3
+    assert aptx.pmfactor(None) == 1.0
+    assert aptx.pmfactor('mas / yr') == 1.0
+    assert np.isnan(aptx.pmfactor('bogus'))
+
+def test_target_table_proper_motions():
+    table = aptx.target_table([
+        record('01 00 00 +60 00 00', '1', 'sec/yr', '1', 'sec/yr'),
+        record('01 00 00 -60 00 00', '2', 'arcsec/yr', '2', 'arcsec/yr'),
+        record('01 00 00 +00 00 00', '3', '', '3', 'mas/yr'),
+    ])
+    # Seconds of time in RA are scaled by cos(dec) to a rate on the sky.
+    # Seconds in Dec are seconds of arc.
+    assert np.allclose(table['pmra'].value, [7500, 2000, 3])
+    assert np.allclose(table['pmdec'].value, [1000, 2000, 3])
+
+def test_records_array_dtypes():
+    targets = aptx.records_array([record('1 2', None, None, None, None)])
+    assert targets.dtype['pmra'] == np.float64
+    assert targets.dtype['pmdec'] == np.float64
+    assert targets.mask['pmra'].all()
+    obs = aptx.records_array([aptx.ObservationRecord('test.aptx', '1', None,
+            'NIRCAM', None, None, None)])
+    assert obs.dtype['mosaic_rows'] == np.int64
+    assert obs.dtype['mosaic_xskew'] == np.float64
+    assert obs.dtype['targetid'].kind == 'U'
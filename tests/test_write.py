@@ -0,0 +1,106 @@
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+import aptx
+from conftest import ROOT
+
+APTXFILE = os.path.join(ROOT, 'aptx', 'udf1.aptx')
+
+class Unseekable(io.RawIOBase):
+    """Write-only stream that cannot seek, like a pipe.
+    """
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.buffer.write(b)
+
+class WritestrOnly:
+    """ZipFile stand-in without the attributes copyraw uses to append raw
+    members.
+    """
+
+    def __init__(self, zfile):
+        self.zfile = zfile
+
+    def writestr(self, info, data):
+        self.zfile.writestr(info, data)
+
+def source_zip(path, seekable=True):
+    """Write zip file with stored, deflated, ZIP64 and empty members. If
+    not seekable, write it like zipfile does to a pipe, with sizes and CRC
+    in data descriptors. Return dictionary of member contents.
+    """
+    members = {'stored.txt': b'stored ' * 100, 'deflated.xml': b'<a/>' * 1000,
+            'zip64.bin': bytes(range(256)) * 50, 'empty': b''}
+    stream = path if seekable else Unseekable()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zfile:
+        zfile.writestr('stored.txt', members['stored.txt'],
+                compress_type=zipfile.ZIP_STORED)
+        zfile.writestr('deflated.xml', members['deflated.xml'])
+        with zfile.open('zip64.bin', 'w', force_zip64=True) as f:
+            f.write(members['zip64.bin'])
+        zfile.writestr('empty', members['empty'])
+    if not seekable:
+        with open(path, 'wb') as f:
+            f.write(stream.buffer.getvalue())
+    return members
+
+def test_strip_extra():
+    extra = b'\x01\x00\x08\x00' + bytes(8) + b'\x55\x54\x05\x00' + bytes(5)
+    assert aptx.strip_extra(extra, (1,)) == b'\x55\x54\x05\x00' + bytes(5)
+    assert aptx.strip_extra(extra, (2,)) == extra
+    assert aptx.strip_extra(b'', (1,)) == b''
+
+@pytest.mark.parametrize('raw', [True, False])
+@pytest.mark.parametrize('descriptors', [False, True])
+@pytest.mark.parametrize('seekable', [True, False])
+def test_copyraw(tmp_path, seekable, descriptors, raw):
+    src = str(tmp_path / 'src.zip')
+    members = source_zip(src, seekable=not descriptors)
+    stream = str(tmp_path / 'dst.zip') if seekable else Unseekable()
+    with zipfile.ZipFile(src) as zsrc, \
+            zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zdst:
+        for info in zsrc.infolist():
+            aptx.copyraw(zsrc, info, zdst if raw else WritestrOnly(zdst))
+        zdst.writestr('new.txt', b'new')
+    if not seekable:
+        stream = io.BytesIO(stream.buffer.getvalue())
+    with zipfile.ZipFile(stream) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == list(members) + ['new.txt']
+        for name, data in members.items():
+            assert zfile.read(name) == data
+        assert zfile.read('new.txt') == b'new'
+
+def test_proposal_write(tmp_path):
+    pytest.importorskip('lxml')
+    newfile = str(tmp_path / 'udf1.aptx')
+    aptx.Proposal(APTXFILE).write(newfile)
+    prop = aptx.Proposal(APTXFILE)
+    with zipfile.ZipFile(APTXFILE) as zold, zipfile.ZipFile(newfile) as znew:
+        assert znew.testzip() is None
+        assert znew.namelist() == zold.namelist()
+        for name in zold.namelist():
+            if name != prop.xmlfile:
+                assert znew.read(name) == zold.read(name)
+        info = znew.getinfo(prop.xmlfile)
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.date_time[:3] == time.localtime()[:3]
+    new = aptx.Proposal(newfile)
+    assert aptx.etree.tostring(new.root) == aptx.etree.tostring(prop.root)
+    assert new.obsnums() == prop.obsnums()
+    # A lazy proposal copies every member, including the XML, raw.
+    lazyfile = str(tmp_path / 'lazy.aptx')
+    aptx.Proposal(APTXFILE, lazy=True).write(lazyfile)
+    with zipfile.ZipFile(APTXFILE) as zold, zipfile.ZipFile(lazyfile) as znew:
+        for name in zold.namelist():
+            assert znew.read(name) == zold.read(name)